@@ -0,0 +1,165 @@
+#Benchmark suite over the shipped spin systems, with per-stage profiles in JSON
+#
+#   python decoherence_mapping_benchmark.py --sizes 64 256 1024 --output benchmark.json
+#   python decoherence_mapping_benchmark.py --systems NV-+15N --cases t2_analytic --compare old.json
+#
+#Every (system, case, grid size) run records the total wall time and points/second, and the
+#stages of decoherence_mapping_profiling (operator construction, Hamiltonian assembly,
+#eigensolver, dispatch, derivative kernels) with calls, seconds, peak memory and throughput.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from decoherence_mapping_parameters import electronic, nuclear
+from decoherence_mapping_functions import (compile_system, generalized_hamiltonian, stencil_offsets, batched_energy_curvature,
+                                           energy_curvature, curvature_transition_energy, t2_map)
+from decoherence_mapping_profiling import profiler
+
+BENCHMARK_VERSION = 1
+
+# Shipped systems; the 13C bath repeats the tabulated NV_13C site k times
+SYSTEMS = {
+    'NV-+14N': ('NV-', ['NV_14N']),
+    'NV-+15N': ('NV-', ['NV_15N']),
+    'VB-+3x14N': ('VB-', ['VB_14N1', 'VB_14N2', 'VB_14N3']),
+    'NV-+14N+1x13C': ('NV-', ['NV_14N'] + ['NV_13C']),
+    'NV-+14N+2x13C': ('NV-', ['NV_14N'] + 2 * ['NV_13C']),
+    'NV-+14N+3x13C': ('NV-', ['NV_14N'] + 3 * ['NV_13C']),
+    }
+
+# Benchmark cases: t2 maps with both derivative methods, the stencil eigenvalue engine, the
+# full curvature_transition_energy pipeline and the per-point joblib path (slow, opt-in)
+CASES = ('t2_analytic', 't2_stencil', 'batched_energy_curvature', 'curvature_transition_energy')
+OPT_IN_CASES = ('joblib_energy_curvature',)
+
+def benchmark_grid(n_points, max_field=0.1, seed=0):
+    """Reproducible field grid (3, N): random directions, magnitudes uniform up to max_field (T)"""
+    rng = np.random.default_rng(seed)
+    direction = rng.normal(size=(3, n_points))
+    return direction / np.linalg.norm(direction, axis=0) * rng.uniform(1e-3, max_field, n_points)
+
+def stencil_grid(field_grid, delta_B=0.1e-3):
+    """Neighbour fields (18, 3, N) of the 19-point stencil around every field"""
+    step = np.full((field_grid.shape[1], 3), delta_B)
+    return (field_grid.T[:, None, :] + stencil_offsets(step)).transpose(1, 2, 0)
+
+def run_case(case, system, field_grid, sigma_B=1e-6):
+    """Run one benchmark case on a compiled system"""
+    if case == 't2_analytic':
+        t2_map(system, field_grid, sigma_B, derivatives='analytic')
+    elif case == 't2_stencil':
+        t2_map(system, field_grid, sigma_B, derivatives='stencil')
+    elif case == 'batched_energy_curvature':
+        batched_energy_curvature(system, field_grid, stencil_grid(field_grid))
+    elif case == 'curvature_transition_energy':
+        curvature_transition_energy(system, field_grid, stencil_grid(field_grid), generalized_hamiltonian)
+    elif case == 'joblib_energy_curvature':
+        energy_curvature((system.electron, system.nuclei), field_grid, stencil_grid(field_grid), generalized_hamiltonian)
+    else:
+        raise ValueError(f"Unknown case '{case}'")
+
+def run_benchmarks(systems=None, cases=CASES, sizes=(64, 256), repeat=3, memory=True, seed=0):
+    """
+    Time every (system, case, grid size) combination
+
+    Every system is compiled once for all its cases (timed as its own 'compile' entry). Each
+    case is run `repeat` times without profiling and the best wall time is kept, then once
+    more under the profiler for the stage breakdown, so tracing overhead does not affect the
+    timings.
+
+    Args:
+        systems: Names from SYSTEMS (default: all)
+        cases: Names from CASES and OPT_IN_CASES
+        sizes: Number of field points per grid
+        repeat: Timed repetitions per combination
+        memory: Record peak memory per stage
+        seed: Seed of the field grids
+
+    Returns:
+        dict: 'metadata' (versions and machine) and 'results', a list of dicts with 'system',
+        'dimension', 'case', 'points', 'seconds', 'points_per_second' and 'stages'
+    """
+    results = []
+    for name in systems or SYSTEMS:
+        electron, nuclei = SYSTEMS[name]
+        spins = (electronic(electron), [nuclear(n) for n in nuclei])
+        # The first compilation also imports QuTiP, the best of the repetitions does not
+        timings = []
+        for _ in range(max(repeat, 2)):
+            started = time.perf_counter()
+            compile_system(spins).ground_energy
+            timings.append(time.perf_counter() - started)
+        with profiler(memory) as profile:
+            system = compile_system(spins)
+            system.ground_energy
+        results.append({'system': name, 'dimension': system.dimension, 'case': 'compile', 'points': 0,
+                        'seconds': min(timings), 'points_per_second': None, 'stages': profile.report()})
+
+        for case in cases:
+            for n_points in sizes:
+                field_grid = benchmark_grid(n_points, seed=seed)
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    run_case(case, system, field_grid)
+                    timings.append(time.perf_counter() - started)
+                with profiler(memory) as profile:
+                    run_case(case, system, field_grid)
+                seconds = min(timings)
+                results.append({'system': name, 'dimension': system.dimension, 'case': case, 'points': n_points,
+                                'seconds': seconds, 'points_per_second': n_points / seconds, 'stages': profile.report()})
+    return {'metadata': metadata(), 'results': results}
+
+def metadata():
+    """Versions and machine details stored with every benchmark run"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'benchmark_version': BENCHMARK_VERSION, 'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+def compare(baseline, current):
+    """
+    Speed-up of `current` over `baseline` (benchmark dicts) for every shared run
+
+    Returns:
+        list: (system, case, points, baseline seconds, current seconds, speed-up) tuples
+    """
+    reference = {(r['system'], r['case'], r['points']): r['seconds'] for r in baseline['results']}
+    return [(r['system'], r['case'], r['points'], reference[key], r['seconds'], reference[key] / r['seconds'])
+            for r in current['results'] for key in [(r['system'], r['case'], r['points'])] if key in reference]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the decoherence mapping pipeline')
+    parser.add_argument('--systems', nargs='+', choices=list(SYSTEMS), help='Systems to run (default: all)')
+    parser.add_argument('--cases', nargs='+', choices=CASES + OPT_IN_CASES, default=list(CASES), help='Cases to run')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[64, 256], help='Field points per grid')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed repetitions per run (best is kept)')
+    parser.add_argument('--no-memory', action='store_true', help='Do not trace peak memory')
+    parser.add_argument('--output', help='JSON output file (default: stdout)')
+    parser.add_argument('--compare', help='Earlier JSON output to compare against')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.systems, args.cases, args.sizes, args.repeat, not args.no_memory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for system, case, points, before, after, speedup in compare(baseline, report):
+            print(f"{system:16} {case:28} {points:8d} {before:10.4f}s {after:10.4f}s {speedup:6.2f}x", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#Content-addressed on-disk cache of eigenvalues per field vector
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+from decoherence_mapping_functions import compile_system, nuclear_tensors, stencil_fields, auto_chunk_size
+
+def system_fingerprint(system):
+    """
+    Stable hash of the spin-system parameters: D, E, g and the dimension of the central spin,
+    g, the A and Q tensors and the dimension of every nucleus (in order), the solver and its
+    settings (fingerprint_parameters, e.g. the coupling_ratio of a reduced_system)
+    """
+    system = compile_system(system)
+    electron = system.electron
+    values = [electron.dimension, electron.D, electron.E, electron.g]
+    for nuc in system.nuclei:
+        A, Q = nuclear_tensors(nuc)
+        values += [nuc.dimension, nuc.g, *A.ravel(), *Q.ravel()]
+    values += list(system.fingerprint_parameters()) if hasattr(system, 'fingerprint_parameters') else []
+    solver = getattr(system, 'solver', 'exact').encode()
+    return hashlib.sha1(solver + np.array(values, dtype=float).tobytes()).hexdigest()
+
+def round_fields(fields, decimals=12):
+    """Fields rounded to `decimals` (T), so that grids built in different ways give the same keys"""
+    return np.round(np.asarray(fields, dtype=float), decimals) + 0.0  # + 0.0 folds -0.0 into 0.0
+
+def point_keys(fingerprint, fields, decimals=12):
+    """Cache keys of single field vectors (M, 3)"""
+    prefix = fingerprint.encode()
+    return [hashlib.sha1(prefix + field.tobytes()).hexdigest() for field in round_fields(fields, decimals).reshape(-1, 3)]
+
+class result_cache:
+    """
+    SQLite-backed store of per-field eigenvalues with a size cap and LRU eviction
+
+    Args:
+        path: Database file (created if needed)
+        max_bytes: Maximum total size of the cached eigenvalues
+    """
+    def __init__(self, path, max_bytes=2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS points '
+                                '(key TEXT PRIMARY KEY, value BLOB, nbytes INTEGER, last_access REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS points_last_access ON points (last_access)')
+        self.connection.commit()
+
+    def get(self, keys):
+        """Dict of the cached raw values for the keys that are present; marks them as used"""
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self.connection.execute(f"SELECT key, value FROM points WHERE key IN ({','.join('?' * len(batch))})", batch)
+            found.update(rows.fetchall())
+        now = time.time()
+        self.connection.executemany('UPDATE points SET last_access = ? WHERE key = ?', [(now, key) for key in found])
+        self.connection.commit()
+        return found
+
+    def put(self, items):
+        """Store (key, ndarray) pairs, then evict the least recently used entries above max_bytes"""
+        now = time.time()
+        self.connection.executemany('INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?)',
+                                    [(key, value.tobytes(), value.nbytes, now) for key, value in items])
+        self.connection.commit()
+        self.evict()
+
+    def size(self):
+        return self.connection.execute('SELECT COALESCE(SUM(nbytes), 0) FROM points').fetchone()[0]
+
+    def evict(self):
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+        rows = self.connection.execute('SELECT key, nbytes FROM points ORDER BY last_access')
+        stale = []
+        for key, nbytes in rows:
+            if excess <= 0:
+                break
+            stale.append((key,))
+            excess -= nbytes
+        self.connection.executemany('DELETE FROM points WHERE key = ?', stale)
+        self.connection.commit()
+
+    def clear(self):
+        self.connection.execute('DELETE FROM points')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+def cached_energy_curvature(system, B_arr, neighbour_arr, cache, chunk_size=None):
+    """
+    Stencil eigenvalues (N, K + 1, d) as in batched_energy_curvature, taking every field that
+    is already in `cache` from there and only diagonalizing the missing ones
+
+    Entries are keyed on the system parameters and a single field vector, and the stencils
+    are rebuilt from them. Overlapping or refined grids therefore reuse every field they share
+    with earlier runs (e.g. the centres of a grid re-run with a finer step), and a neighbour
+    that coincides with another point's centre is diagonalized only once.
+    """
+    system = compile_system(system)
+    fields = stencil_fields(np.asarray(B_arr, dtype=float), np.asarray(neighbour_arr, dtype=float))
+    d = system.dimension
+    flat = fields.reshape(-1, 3)
+    # One entry per distinct (rounded) field; the first exact field of each is diagonalized
+    unique, first, inverse = np.unique(round_fields(flat), axis=0, return_index=True, return_inverse=True)
+    keys = point_keys(system_fingerprint(system), unique)
+
+    values = np.empty((len(unique), d))
+    found = cache.get(keys)
+    missing = []
+    for i, key in enumerate(keys):
+        if key in found:
+            values[i] = np.frombuffer(found[key], dtype=float)
+        else:
+            missing.append(i)
+
+    if missing:
+        if chunk_size is None:
+            chunk_size = auto_chunk_size(1, d)
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            values[chunk] = system.eigenvalues(flat[first[chunk]]) - system.ground_energy
+        cache.put([(keys[i], values[i]) for i in missing])
+    return values[inverse.ravel()].reshape(fields.shape[:2] + (d,))
@@ -0,0 +1,111 @@
+#Headless entry point: run a T2 map or a stencil sweep from a JSON config file
+#
+#   python decoherence_mapping_cli.py config.json [--output result.npz] [--progress]
+#
+#Example config (fields in T, sigma_B in T):
+#
+#   {"electron": "VB-", "nuclei": ["VB_14N1", "VB_14N2", "VB_14N3"],
+#    "grid": {"magnitudes": [0.01, 0.05, 0.1], "n_theta": 31, "n_phi": 60},
+#    "task": "t2", "sigma_B": 1e-6, "top_k": 3, "output": "vb_t2.npz"}
+#
+#Keys:
+#   electron, nuclei: Registered species names (nuclei may be empty)
+#   species_file: Optional extra species table, see register_species
+#   solver: 'exact' (default) or 'reduced' (reduced_system, with optional coupling_ratio)
+#   grid: {"magnitudes", "n_theta", "n_phi"} for spherical shells (theta from 0 to pi,
+#       phi over [0, 2 pi)), or {"file": "fields.npy"} with fields of shape (3, N)
+#   task: 't2' (default) writes an .npz with fields, t2, transition and pairs;
+#       'sweep' writes a resumable sweep store (sweep_to_disk) to the output directory
+#   sigma_B, transitions, top_k, derivatives, delta_B, degeneracy_tol: t2_map options
+#       (derivatives defaults to 'stencil' for the reduced solver, which has no analytic path)
+#   symmetry: Evaluate only the irreducible wedge of the grid (symmetric_t2_map)
+#   chunk_size: Field points per chunk
+#   output: Output file ('t2') or directory ('sweep')
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from decoherence_mapping_parameters import register_species, electronic, nuclear
+from decoherence_mapping_functions import compile_system, transition_pairs, stencil_offsets, tqdm_progress, t2_map
+from decoherence_mapping_search import spherical_to_field
+
+T2_OPTIONS = ('transitions', 'top_k', 'derivatives', 'delta_B', 'degeneracy_tol', 'chunk_size')
+
+def build_system(config):
+    """System for the 'electron', 'nuclei' and 'solver' entries of a config"""
+    if config.get('species_file'):
+        register_species(config['species_file'])
+    electron = electronic(config['electron'])
+    nuclei = [nuclear(name) for name in config.get('nuclei', [])]
+    solver = config.get('solver', 'exact')
+    if solver == 'exact':
+        return compile_system((electron, nuclei))
+    elif solver == 'reduced':
+        from decoherence_mapping_reduced import reduced_system
+        return reduced_system(electron, nuclei, config.get('coupling_ratio', 10))
+    raise ValueError(f"Unknown solver '{solver}'")
+
+def build_field_grid(grid):
+    """Field grid (3, N) for the 'grid' entry of a config"""
+    if 'file' in grid:
+        return np.load(grid['file'])
+    theta = np.linspace(0, np.pi, grid['n_theta'])
+    phi = np.linspace(0, 2 * np.pi, grid['n_phi'], endpoint=False)
+    r, theta, phi = np.meshgrid(np.asarray(grid['magnitudes'], dtype=float), theta, phi, indexing='ij')
+    return spherical_to_field(r, theta, phi).reshape(-1, 3).T
+
+def run(config, progress=None):
+    """
+    Run the task of a config and write its output
+
+    Returns:
+        dict: Summary with the task, output path, number of field points and wall time
+    """
+    started = time.perf_counter()
+    system = build_system(config)
+    field_grid = build_field_grid(config['grid'])
+    task = config.get('task', 't2')
+    output = config['output']
+
+    if task == 't2':
+        options = {key: config[key] for key in T2_OPTIONS if config.get(key) is not None}
+        if config.get('solver') == 'reduced':
+            options.setdefault('derivatives', 'stencil')
+        if config.get('symmetry'):
+            from decoherence_mapping_symmetry import symmetric_t2_map
+            t2, index = symmetric_t2_map(system, field_grid, config['sigma_B'], **options)
+        else:
+            t2, index = t2_map(system, field_grid, config['sigma_B'], progress=progress, **options)
+        pairs = transition_pairs(system.dimension) if config.get('transitions') is None else np.asarray(config['transitions'], dtype=int)
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        np.savez(output, fields=field_grid, t2=t2, transition=index, pairs=pairs, sigma_B=config['sigma_B'])
+    elif task == 'sweep':
+        from decoherence_mapping_store import sweep_to_disk
+        step = np.broadcast_to(np.asarray(config.get('delta_B', 0.1e-3), dtype=float), (field_grid.shape[1], 3))
+        neighbour_arr = field_grid.T[:, None, :] + stencil_offsets(step)
+        sweep_to_disk(system, field_grid, neighbour_arr.transpose(1, 2, 0), output,
+                      chunk_size=config.get('chunk_size'), progress=progress)
+    else:
+        raise ValueError(f"Unknown task '{task}'")
+
+    return {'task': task, 'output': output, 'points': field_grid.shape[1], 'seconds': time.perf_counter() - started}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a decoherence map from a JSON config file')
+    parser.add_argument('config', help='JSON config file')
+    parser.add_argument('-o', '--output', help="Output path, overrides 'output' of the config")
+    parser.add_argument('--progress', action='store_true', help='Show a progress bar (requires tqdm)')
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    if args.output:
+        config['output'] = args.output
+    summary = run(config, tqdm_progress(file=sys.stderr) if args.progress else None)
+    print(json.dumps(summary))
+
+if __name__ == '__main__':
+    main()
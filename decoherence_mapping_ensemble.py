@@ -0,0 +1,160 @@
+#Batched parameter-ensemble sweeps over D, E and hyperfine/quadrupole tensors
+import itertools
+import numpy as np
+from decoherence_mapping_functions import (compile_system, require_hamiltonians, generalized_operators, nuclear_tensors,
+                                           auto_chunk_size, perturbative_derivatives, stencil_fallback, transition_pairs,
+                                           transition_derivatives, transition_t2)
+
+AXES = 'xyz'
+
+def parameter_operators(system, names):
+    """
+    Operators O_k and nominal values p_k of the Hamiltonian parameters, H = ... + sum_k p_k O_k
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        names: Parameter names: 'D', 'E', or (nucleus index, component) tuples such as
+            (0, 'A_zz') or (2, 'Q_xy') for the hyperfine and quadrupole tensor components
+
+    Returns:
+        Tuple: (operators (P, d, d), nominal values (P,))
+    """
+    system = compile_system(system)
+    S, I_list = generalized_operators(system.electron, system.nuclei)
+    operators, nominal = [], []
+    for name in names:
+        if name == 'D':
+            operators.append(S[2]**2 - 2/3)
+            nominal.append(system.electron.D)
+        elif name == 'E':
+            operators.append(S[1]**2 - S[0]**2)
+            nominal.append(system.electron.E)
+        else:
+            k, component = name
+            tensor, (i, j) = component[0], (AXES.index(component[2]), AXES.index(component[3]))
+            A, Q = nuclear_tensors(system.nuclei[k])
+            if tensor == 'A':
+                operators.append(S[i] * I_list[k][j])
+                nominal.append(A[i, j])
+            elif tensor == 'Q':
+                operators.append(I_list[k][i] * I_list[k][j])
+                nominal.append(Q[i, j])
+            else:
+                raise ValueError(f"Unknown parameter {name}")
+    return np.stack([op.full() for op in operators]), np.array(nominal, dtype=float)
+
+def ensemble_samples(parameters, mode='product', n_samples=None, seed=0):
+    """
+    Parameter samples from arrays of values
+
+    Args:
+        parameters: Dict mapping parameter names (see parameter_operators) to 1D value arrays
+        mode: 'product' (cartesian product), 'sampled' (n_samples random members of the
+            product) or 'zip' (arrays of equal length taken together, e.g. correlated draws)
+        n_samples: Number of samples for 'sampled' (required)
+        seed: Seed for 'sampled'
+
+    Returns:
+        Tuple: (names, samples with shape (S, P))
+    """
+    names = list(parameters)
+    values = [np.atleast_1d(np.asarray(parameters[name], dtype=float)) for name in names]
+    if mode == 'zip':
+        samples = np.stack(values, axis=-1)
+    elif mode == 'product':
+        samples = np.array(list(itertools.product(*values)), dtype=float)
+    elif mode == 'sampled':
+        if n_samples is None:
+            raise ValueError("mode 'sampled' requires n_samples")
+        rng = np.random.default_rng(seed)
+        samples = np.stack([v[rng.integers(len(v), size=n_samples)] for v in values], axis=-1)
+    else:
+        raise ValueError(f"Unknown mode '{mode}'")
+    return names, samples.reshape(-1, len(names))
+
+def ensemble_maps(system, field_grid, sigma_B, parameters, mode='product', n_samples=None, weights=None,
+                  transitions=None, delta_B=0.1e-3, degeneracy_tol=1e-3, chunk_size=None, seed=0):
+    """
+    Ensemble-averaged transition frequency, gradient, curvature and T2 maps
+
+    H is linear in the field and in D, E, A and Q, so the Hamiltonians of all
+    (sample, field) combinations of a chunk are built with two tensor contractions and
+    passed to the perturbative derivative engine as a single (S, n, d, d) stack; no Python
+    code runs per sample.
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        field_grid: Magnetic fields with shape (3, N)
+        sigma_B: Standard deviation of the field noise (T)
+        parameters: Dict mapping parameter names (see parameter_operators) to value arrays
+        mode, n_samples, seed: How samples are drawn, see ensemble_samples
+        weights: Optional sample weights (S,) (default: uniform)
+        transitions: (lower, upper) level pairs (default: the three ms families)
+        delta_B: Stencil step size(s) for the degenerate-level fallback
+        degeneracy_tol: Level spacing (MHz) below which the stencil fallback is used
+        chunk_size: Field points per chunk (default: sized from samples and dimension)
+
+    Returns:
+        dict: 'frequency', 'gradient', 'curvature' and 't2' with shape (N, P), weighted over
+        the ensemble, plus 'names', 'samples' and 'weights'
+    """
+    system = compile_system(system)
+    require_hamiltonians(system)
+    field_grid = np.asarray(field_grid, dtype=float)
+    names, samples = ensemble_samples(parameters, mode, n_samples, seed)
+    weights = np.full(len(samples), 1 / len(samples)) if weights is None else np.asarray(weights, dtype=float) / np.sum(weights)
+    operators, nominal = parameter_operators(system, names)
+    # Change of the static Hamiltonian for every sample, (S, d, d)
+    shift = np.tensordot(samples - nominal, operators, axes=(1, 0))
+
+    n_draws, n_points, d = len(samples), field_grid.shape[1], system.dimension
+    pairs = transition_pairs(d) if transitions is None else np.asarray(transitions, dtype=int).reshape(-1, 2)
+    if chunk_size is None:
+        chunk_size = auto_chunk_size(5 * n_draws, d)
+
+    maps = {name: np.empty((n_points, len(pairs))) for name in ('frequency', 'gradient', 'curvature', 't2')}
+    for start in range(0, n_points, chunk_size):
+        stop = min(start + chunk_size, n_points)
+        fields = field_grid[:, start:stop].T
+        n = stop - start
+        H = shift[:, None] + system.hamiltonians(fields)[None]
+        E, grad, hess, degenerate = perturbative_derivatives(H, system.M, degeneracy_tol)
+
+        # Flatten (sample, field) to one axis; index i belongs to sample i // n and field i % n
+        E, grad, hess, degenerate = (a.reshape((-1,) + a.shape[2:]) for a in (E, grad, hess, degenerate))
+        step = np.broadcast_to(np.asarray(delta_B, dtype=float), (n_draws * n, 3))
+        stencil_fallback(lambda stencil, index: np.linalg.eigvalsh(shift[index // n, None] + system.hamiltonians(stencil)),
+                         np.tile(fields, (n_draws, 1)), step, degenerate, grad, hess)
+
+        frequency, gradient, curvature = transition_derivatives(E, grad, hess, pairs)
+        t2 = transition_t2(grad, hess, pairs, sigma_B)
+        for name, values in (('frequency', frequency), ('gradient', gradient), ('curvature', curvature), ('t2', t2)):
+            maps[name][start:stop] = np.tensordot(weights, values.reshape(n_draws, n, -1), axes=(0, 0))
+
+    maps.update(names=names, samples=samples, weights=weights)
+    return maps
+
+def configuration_average(configurations, field_grid, sigma_B, parameters=None, **ensemble_options):
+    """
+    Best-transition T2 map averaged over isotope configurations (and parameter ensembles)
+
+    Configurations have different level structures, so their maps are combined through the
+    best ensemble-averaged T2 per field point.
+
+    Args:
+        configurations: List of (system, weight) pairs, e.g. NV- with 14N and with 15N
+        field_grid: Magnetic fields with shape (3, N)
+        sigma_B: Standard deviation of the field noise (T)
+        parameters: Parameter ensemble applied to every configuration (default: nominal)
+        **ensemble_options: Passed on to ensemble_maps
+
+    Returns:
+        ndarray: Weighted T2 with shape (N,)
+    """
+    total = sum(weight for _, weight in configurations)
+    t2 = 0
+    for system, weight in configurations:
+        system = compile_system(system)
+        maps = ensemble_maps(system, field_grid, sigma_B, parameters or {'D': [system.electron.D]}, **ensemble_options)
+        t2 = t2 + weight / total * maps['t2'].max(axis=1)
+    return t2
@@ -1,11 +1,32 @@
 #Impoting all the libraries
-from qutip import tensor,qeye
+#Only NumPy is imported up front; QuTiP, joblib and tqdm are imported by the functions that
+#use them, and plotting lives in decoherence_mapping_plotting, so batch jobs and worker
+#processes start without loading them
 import numpy as np
-from tqdm.notebook import trange
-from joblib import Parallel, delayed
-from plotly import graph_objs as go
-from plotly.subplots import make_subplots
 from decoherence_mapping_parameters import nuclear, electronic
+from decoherence_mapping_profiling import stage
+
+def tqdm_progress(**options):
+    """
+    Progress callback showing a tqdm bar (tqdm.auto, so it works in notebooks and terminals)
+
+    Args:
+        **options: Passed on to tqdm, e.g. desc or leave
+
+    Returns:
+        Callable progress(done, total) for the `progress` arguments of the sweep functions
+    """
+    bar = None
+
+    def progress(done, total):
+        nonlocal bar
+        if bar is None:
+            from tqdm.auto import tqdm
+            bar = tqdm(total=total, **options)
+        bar.update(done - bar.n)
+        if done >= total:
+            bar.close()
+    return progress
 
 def generalized_operators(electron, nuclei):
     """
@@ -18,20 +39,23 @@ def generalized_operators(electron, nuclei):
     Returns:
         Tuple: (S_operators, [I_operators_list])
     """
-    # Central spin operators
-    S_op = [
-        tensor(electron.Sx, *[qeye(n.dimension) for n in nuclei]),
-        tensor(electron.Sy, *[qeye(n.dimension) for n in nuclei]),
-        tensor(electron.Sz, *[qeye(n.dimension) for n in nuclei])
-        ]
-    
-    # Nuclear spin operators
-    I_ops = []
-    for i, nuc in enumerate(nuclei):
-        Ix = tensor(qeye(electron.dimension), *[qeye(n.dimension) if j != i else nuc.Ix for j, n in enumerate(nuclei)])
-        Iy = tensor(qeye(electron.dimension), *[qeye(n.dimension) if j != i else nuc.Iy for j, n in enumerate(nuclei)])
-        Iz = tensor(qeye(electron.dimension), *[qeye(n.dimension) if j != i else nuc.Iz for j, n in enumerate(nuclei)])
-        I_ops.append((Ix, Iy, Iz))
+    from qutip import tensor, qeye
+
+    with stage('operators'):
+        # Central spin operators
+        S_op = [
+            tensor(electron.Sx, *[qeye(n.dimension) for n in nuclei]),
+            tensor(electron.Sy, *[qeye(n.dimension) for n in nuclei]),
+            tensor(electron.Sz, *[qeye(n.dimension) for n in nuclei])
+            ]
+        
+        # Nuclear spin operators
+        I_ops = []
+        for i, nuc in enumerate(nuclei):
+            Ix = tensor(qeye(electron.dimension), *[qeye(n.dimension) if j != i else nuc.Ix for j, n in enumerate(nuclei)])
+            Iy = tensor(qeye(electron.dimension), *[qeye(n.dimension) if j != i else nuc.Iy for j, n in enumerate(nuclei)])
+            Iz = tensor(qeye(electron.dimension), *[qeye(n.dimension) if j != i else nuc.Iz for j, n in enumerate(nuclei)])
+            I_ops.append((Ix, Iy, Iz))
     
     return S_op, I_ops
 
@@ -47,23 +71,187 @@ def generalized_hamiltonian(electron, nuclei, Bx, By, Bz):
     Returns:
         Qobj: Full system Hamiltonian
     """
+    from qutip import Qobj
+
     S, I_list = generalized_operators(electron, nuclei)
-    
-    # Central spin terms
-    H = (electron.D * (S[2]**2 - 2/3) + electron.E * (S[1]**2 - S[0]**2) -electron.g * (S[0]*Bx + S[1]*By + S[2]*Bz))
-    
-    # Add nuclear terms
-    for i, (nuc, (Ix, Iy, Iz)) in enumerate(zip(nuclei, I_list)):
-        # Hyperfine interaction
-        H += nuc.A_xx * S[0] * Ix + nuc.A_yy * S[1] * Iy + nuc.A_zz * S[2] * Iz + nuc.A_xy * S[0] * Iy + nuc.A_yx * S[1] * Ix + nuc.A_xz * S[0] * Iz + nuc.A_zx * S[2] * Ix + nuc.A_yz * S[1] * Iz + nuc.A_zy * S[2] * Iy
+    return Qobj(operator_hamiltonian(electron, nuclei, S, I_list, (Bx, By, Bz)), dims=S[0].dims)
+
+def operator_hamiltonian(electron, nuclei, S, I_list, B):
+    """
+    Dense Hamiltonian from already built spin operators, as in generalized_hamiltonian
+
+    Args:
+        electron: Central spin system with parameters
+        nuclei: List of nuclear spin systems with parameters
+        S, I_list: Operators returned by generalized_operators(electron, nuclei)
+        B: Magnetic field vector (Bx, By, Bz)
+
+    Returns:
+        ndarray: Hamiltonian with shape (d, d)
+    """
+    with stage('hamiltonian', 1):
+        S_arr = np.stack([op.full() for op in S])
+        B = np.asarray(B, dtype=float)
         
-        # Nuclear Zeeman
-        H -= nuc.g * (Ix*Bx + Iy*By + Iz*Bz)
+        # Central spin terms
+        H = (electron.D * (S_arr[2] @ S_arr[2] - 2/3 * np.eye(len(S_arr[2]))) + electron.E * (S_arr[1] @ S_arr[1] - S_arr[0] @ S_arr[0])
+             - electron.g * np.tensordot(B, S_arr, axes=1))
         
-        # Quadrupole interaction
-        H += nuc.Q_xx * Ix**2 + nuc.Q_yy * Iy**2 + nuc.Q_zz * Iz**2 + nuc.Q_xy * Ix * Iy + nuc.Q_yx * Iy * Ix + nuc.Q_xz * Ix * Iz + nuc.Q_zx * Iz * Ix + nuc.Q_yz * Iy * Iz + nuc.Q_zy * Iz * Iy
+        # Add nuclear terms, one tensor contraction per interaction
+        for nuc, I in zip(nuclei, I_list):
+            I_arr = np.stack([op.full() for op in I])
+            
+            # Hyperfine interaction S.A.I
+            H += np.einsum('ij,iab,jbc->ac', nuc.A, S_arr, I_arr, optimize=True)
+            
+            # Nuclear Zeeman
+            H -= nuc.g * np.tensordot(B, I_arr, axes=1)
+            
+            # Quadrupole interaction I.Q.I
+            H += np.einsum('ij,iab,jbc->ac', nuc.Q, I_arr, I_arr, optimize=True)
         
-    return H
+        return H
+
+class compiled_system:
+    """
+    Field-independent decomposition of the Hamiltonian, H(B) = H_static + Bx*Mx + By*My + Bz*Mz
+
+    The spin operators and the four dense matrices are built once per (electron, nuclei)
+    combination, after which the Hamiltonian for any field (or stack of fields) is a single
+    multiply-add in NumPy.
+
+    Args:
+        electron: Central spin system with parameters
+        nuclei: List of nuclear spin systems with parameters
+    """
+    def __init__(self, electron, nuclei):
+        self.electron = electron
+        self.nuclei = list(nuclei)
+
+        with stage('compile'):
+            S, I_list = generalized_operators(electron, self.nuclei)
+
+            # Zero-field part: crystal field, hyperfine and quadrupole terms
+            self.H_static = operator_hamiltonian(electron, self.nuclei, S, I_list, (0, 0, 0))
+
+            # Zeeman part: one matrix per field component
+            M = []
+            for i in range(3):
+                M_i = -electron.g * S[i]
+                for nuc, I in zip(self.nuclei, I_list):
+                    M_i -= nuc.g * I[i]
+                M.append(M_i.full())
+            self.M = np.stack(M)
+
+        self.dims = S[0].dims
+        self.dimension = self.H_static.shape[0]
+        self._ground_energy = None
+
+    def fingerprint_parameters(self):
+        """Solver settings that change the eigenvalues, hashed by system_fingerprint (none here)"""
+        return ()
+
+    def hamiltonian(self, Bx, By, Bz):
+        """Dense Hamiltonian (d, d) for a single field"""
+        return self.H_static + Bx * self.M[0] + By * self.M[1] + Bz * self.M[2]
+
+    def hamiltonians(self, fields):
+        """
+        Stack of dense Hamiltonians for many fields
+
+        Args:
+            fields: Array of magnetic field vectors with shape (..., 3)
+
+        Returns:
+            ndarray: Hamiltonians with shape (..., d, d)
+        """
+        fields = np.asarray(fields, dtype=float)
+        with stage('hamiltonian', fields[..., 0].size):
+            return np.tensordot(fields, self.M, axes=(-1, 0)) + self.H_static
+
+    def eigenvalues(self, fields):
+        """Sorted eigenvalues with shape (..., d) for a stack of fields (..., 3)"""
+        H = self.hamiltonians(fields)
+        with stage('eigensolve', H[..., 0, 0].size):
+            return np.linalg.eigvalsh(H)
+
+    @property
+    def ground_energy(self):
+        """Lowest zero-field eigenvalue, used as the energy reference (computed once)"""
+        if self._ground_energy is None:
+            self._ground_energy = np.linalg.eigvalsh(self.H_static)[0]
+        return self._ground_energy
+
+def compile_system(system):
+    """
+    Return a compiled_system for `system`, which is either an (electron, nuclei) tuple
+    or an already compiled system (returned as is). Any object providing `eigenvalues`,
+    such as a reduced_system, is also passed through.
+    """
+    if hasattr(system, 'eigenvalues'):
+        return system
+    return compiled_system(system[0], system[1])
+
+def require_hamiltonians(system):
+    """
+    Raise a ValueError if `system` only provides eigenvalues (e.g. a reduced_system), since
+    the perturbative derivatives need the Hamiltonians and the Zeeman matrices
+    """
+    if not (hasattr(system, 'hamiltonians') and hasattr(system, 'M')):
+        raise ValueError(f"{type(system).__name__} only provides eigenvalues, use derivatives='stencil'")
+
+def nuclear_tensors(nuc):
+    """Hyperfine and quadrupole tensors of a nuclear spin system as 3x3 arrays"""
+    return np.asarray(nuc.A, dtype=float), np.asarray(nuc.Q, dtype=float)
+
+def auto_chunk_size(points_per_field, dimension, target_bytes=64 * 2**20):
+    """
+    Number of field points per chunk so that the stacked complex Hamiltonians of one chunk
+    take roughly `target_bytes` of memory
+    """
+    bytes_per_point = points_per_field * dimension * dimension * 16
+    return max(1, int(target_bytes // bytes_per_point))
+
+def stencil_fields(B_arr, neighbour_arr):
+    """
+    Merge the central fields (3, N) and the neighbour fields (K, 3, N) into a single
+    (N, K + 1, 3) array, central point first
+    """
+    return np.concatenate([B_arr[None], neighbour_arr], axis=0).transpose(2, 0, 1)
+
+def batched_energy_curvature(system, B_arr, neighbour_arr, chunk_size=None, progress=None):
+    """
+    Eigenvalues of the central and neighbour Hamiltonians for every field point
+
+    The (N, K + 1, d, d) Hamiltonian stack is assembled and diagonalized chunk by chunk
+    with an eigenvalues-only batched solver. The zero-field reference is computed once.
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        B_arr: Central magnetic fields with shape (3, N)
+        neighbour_arr: Neighbour magnetic fields with shape (K, 3, N)
+        chunk_size: Field points per chunk (default: sized from the Hilbert-space dimension)
+        progress: Optional callback progress(done, total), called with the number of finished
+            field points after every chunk (see tqdm_progress)
+
+    Returns:
+        ndarray: Eigenvalues with shape (N, K + 1, d), same layout as energy_curvature
+    """
+    system = compile_system(system)
+    fields = stencil_fields(np.asarray(B_arr, dtype=float), np.asarray(neighbour_arr, dtype=float))
+    n_points = fields.shape[0]
+    if chunk_size is None:
+        chunk_size = auto_chunk_size(fields.shape[1], system.dimension)
+
+    eigenvalues = np.empty(fields.shape[:2] + (system.dimension,))
+    with stage('batched_energy_curvature', n_points):
+        for start in range(0, n_points, chunk_size):
+            stop = min(start + chunk_size, n_points)
+            eigenvalues[start:stop] = system.eigenvalues(fields[start:stop])
+            if progress is not None:
+                progress(stop, n_points)
+        eigenvalues -= system.ground_energy
+    return eigenvalues
 
 def compute_eigenvalues_for_point(system, i, B_arr, neighbour_arr, generalized_hamiltonian):
     
@@ -72,107 +260,417 @@ def compute_eigenvalues_for_point(system, i, B_arr, neighbour_arr, generalized_h
     H = generalized_hamiltonian(system[0], system[1], B_arr[0, i], B_arr[1, i], B_arr[2, i])
     H_0 = generalized_hamiltonian(system[0], system[1], 0, 0, 0)
     eigenvalues_point = np.zeros((neighbour_arr.shape[0] + 1, H.shape[0]))
-    eigenvalues_point[0, :] = (np.sort(H.eigenstates()[0]) - np.sort(H_0.eigenstates()[0])[0])
+    with stage('eigensolve', 2):
+        eigenvalues_point[0, :] = (np.sort(H.eigenstates()[0]) - np.sort(H_0.eigenstates()[0])[0])
     
     # Compute eigenvalues for neighbor points
     for k in range(neighbour_arr.shape[0]):
         H = generalized_hamiltonian(system[0], system[1], neighbour_arr[k, 0, i], neighbour_arr[k, 1, i], neighbour_arr[k, 2, i])
-        eigenvalues_point[k + 1, :] = (np.sort(H.eigenstates()[0]) - np.sort(H_0.eigenstates()[0])[0])
+        with stage('eigensolve', 2):
+            eigenvalues_point[k + 1, :] = (np.sort(H.eigenstates()[0]) - np.sort(H_0.eigenstates()[0])[0])
     
     return eigenvalues_point
 
 
-def energy_curvature(system, B_arr, neighbour_arr, generalized_hamiltonian, n_jobs=-1):
-    # Use joblib to parallelize the outer loop
-    results = Parallel(n_jobs=n_jobs)(delayed(compute_eigenvalues_for_point)(system, i, B_arr, neighbour_arr, generalized_hamiltonian)
-                                      for i in trange(neighbour_arr.shape[2]))
+def energy_curvature(system, B_arr, neighbour_arr, generalized_hamiltonian, n_jobs=-1, progress=None):
+    from joblib import Parallel, delayed
+
+    # The per-point path rebuilds the Hamiltonian from the (electron, nuclei) tuple
+    if isinstance(system, compiled_system):
+        system = (system.electron, system.nuclei)
+    elif not isinstance(system, (tuple, list)):
+        raise ValueError(f"The joblib engine needs an (electron, nuclei) tuple or compiled_system, not {type(system).__name__}")
+
+    # Report tasks as they are dispatched, as the progress bar of the notebook version did
+    n_points = neighbour_arr.shape[2]
+    def points():
+        for i in range(n_points):
+            yield i
+            if progress is not None:
+                progress(i + 1, n_points)
+
+    # Use joblib to parallelize the outer loop; stages run in worker processes are not recorded
+    with stage('dispatch', n_points):
+        results = Parallel(n_jobs=n_jobs)(delayed(compute_eigenvalues_for_point)(system, i, B_arr, neighbour_arr, generalized_hamiltonian)
+                                          for i in points())
     
     # Stack results into a single array
     eigenvalues = np.stack(results)
     return eigenvalues
 
+# Signs of the 18 neighbour offsets, in the neighbour_arr order used by curvature_transition_energy:
+# +x, -x, +y, -y, +z, -z, then (++, +-, -+, --) for the xy, xz and yz pairs
+STENCIL_SIGNS = np.array([
+    [1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1],
+    [1, 1, 0], [1, -1, 0], [-1, 1, 0], [-1, -1, 0],
+    [1, 0, 1], [1, 0, -1], [-1, 0, 1], [-1, 0, -1],
+    [0, 1, 1], [0, 1, -1], [0, -1, 1], [0, -1, -1],
+    ], dtype=float)
+
+def stencil_step(B_arr, neighbour_arr):
+    """
+    Field step sizes (N, 3) of a stencil grid, read from the +x, +y and +z neighbours
+    """
+    return np.stack([neighbour_arr[0, 0] - B_arr[0],
+                     neighbour_arr[2, 1] - B_arr[1],
+                     neighbour_arr[4, 2] - B_arr[2]], axis=-1)
+
+def stencil_offsets(step):
+    """
+    Neighbour field offsets (..., 18, 3) for step sizes of shape (..., 3)
+    """
+    return STENCIL_SIGNS * np.asarray(step, dtype=float)[..., None, :]
+
+def stencil_level_derivatives(Energies, step):
+    """
+    Central-difference gradient and Hessian of every energy level
+
+    Args:
+        Energies: Stencil eigenvalues with shape (N, 19, d), as returned by energy_curvature
+        step: Field step sizes with shape (N, 3) or (3,)
+
+    Returns:
+        Tuple: (gradient (N, d, 3), hessian (N, d, 3, 3))
+    """
+    E = Energies
+    h = np.broadcast_to(np.asarray(step, dtype=float), (E.shape[0], 3))[:, None, :]
+
+    with stage('derivatives', E.shape[0]):
+        gradient = np.stack([E[:, 1] - E[:, 2], E[:, 3] - E[:, 4], E[:, 5] - E[:, 6]], axis=-1) / (2 * h)
+
+        hessian = np.empty(gradient.shape + (3,))
+        for i in range(3):
+            hessian[..., i, i] = (E[:, 2*i + 1] - 2*E[:, 0] + E[:, 2*i + 2]) / h[..., i]**2
+        for n, (i, j) in enumerate(((0, 1), (0, 2), (1, 2))):
+            o = 7 + 4*n
+            hessian[..., i, j] = (E[:, o] - E[:, o + 1] - E[:, o + 2] + E[:, o + 3]) / (4 * h[..., i] * h[..., j])
+            hessian[..., j, i] = hessian[..., i, j]
+    return gradient, hessian
+
+def perturbative_derivatives(H, M, degeneracy_tol=1e-3):
+    """
+    Energy levels with their field gradient and Hessian from a single diagonalization
+
+    Uses the Hellmann-Feynman theorem, dE_n/dB_i = <n|M_i|n>, and second-order perturbation
+    theory, d2E_n/dB_i dB_j = 2 Re sum_{m!=n} <n|M_i|m><m|M_j|n> / (E_n - E_m).
+
+    Args:
+        H: Hamiltonians with shape (..., d, d)
+        M: Zeeman matrices (3, d, d), H(B) = H_static + B.M
+        degeneracy_tol: Level spacing (MHz) below which a level is treated as degenerate
+
+    Returns:
+        Tuple: (energies (..., d), gradient (..., d, 3), hessian (..., d, 3, 3),
+                degenerate mask (..., d))
+    """
+    n_matrices = H[..., 0, 0].size
+    with stage('eigensolve', n_matrices):
+        E, V = np.linalg.eigh(H)
+
+    with stage('derivatives', n_matrices):
+        # Zeeman matrices in the eigenbasis, (..., 3, d, d)
+        V = V[..., None, :, :]
+        M_eig = V.conj().swapaxes(-1, -2) @ M @ V
+
+        gradient = np.moveaxis(np.diagonal(M_eig, axis1=-2, axis2=-1).real, -2, -1).copy()
+
+        gap = E[..., :, None] - E[..., None, :]
+        close = np.abs(gap) < degeneracy_tol
+        np.einsum('...ii->...i', close)[...] = False
+        with np.errstate(divide='ignore'):
+            weight = np.where(close | (gap == 0), 0, 1 / gap)
+        hessian = 2 * np.einsum('...inm,...nm,...jnm->...nij', M_eig, weight, M_eig.conj()).real
+
+    return E, gradient, hessian, close.any(axis=-1)
+
+def stencil_fallback(eigenvalues, fields, step, degenerate, gradient, hessian):
+    """
+    Replace, in place, the perturbative derivatives of near-degenerate levels by stencil ones
+
+    Args:
+        eigenvalues: Callable (stencil fields (n, 19, 3), point indices (n,)) -> eigenvalues (n, 19, d)
+        fields: Central fields with shape (N, 3)
+        step: Stencil step sizes with shape (N, 3)
+        degenerate: Near-degenerate level mask with shape (N, d)
+        gradient, hessian: Level derivatives (N, d, 3) and (N, d, 3, 3), updated in place
+    """
+    points = np.flatnonzero(degenerate.any(axis=-1))
+    if not points.size:
+        return
+    with stage('fallback', points.size):
+        stencil = fields[points, None, :] + np.concatenate([np.zeros((points.size, 1, 3)), stencil_offsets(step[points])], axis=1)
+        grad_fd, hess_fd = stencil_level_derivatives(eigenvalues(stencil, points), step[points])
+        mask = degenerate[points]
+        gradient[points] = np.where(mask[..., None], grad_fd, gradient[points])
+        hessian[points] = np.where(mask[..., None, None], hess_fd, hessian[points])
+
+def analytic_level_derivatives(system, B_arr, step=0.1e-3, degeneracy_tol=1e-3, chunk_size=None):
+    """
+    Energy levels, gradients and Hessians from one diagonalization per field point
+
+    Levels closer than `degeneracy_tol` to another level have no well-defined perturbative
+    derivatives; at those points the affected levels fall back to the finite-difference
+    stencil with the given step.
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        B_arr: Magnetic fields with shape (3, N)
+        step: Fallback stencil step sizes with shape (N, 3) or (3,), or a scalar
+        degeneracy_tol: Level spacing (MHz) below which the stencil fallback is used
+        chunk_size: Field points per chunk (default: sized from the Hilbert-space dimension)
+
+    Returns:
+        Tuple: (energies (N, d), gradient (N, d, 3), hessian (N, d, 3, 3))
+    """
+    system = compile_system(system)
+    require_hamiltonians(system)
+    fields = np.asarray(B_arr, dtype=float).T
+    n_points, d = fields.shape[0], system.dimension
+    step = np.broadcast_to(np.asarray(step, dtype=float), (n_points, 3))
+    if chunk_size is None:
+        # eigenvectors and the three rotated Zeeman matrices are kept per point
+        chunk_size = auto_chunk_size(5, d)
+
+    energies = np.empty((n_points, d))
+    gradient = np.empty((n_points, d, 3))
+    hessian = np.empty((n_points, d, 3, 3))
+    for start in range(0, n_points, chunk_size):
+        stop = min(start + chunk_size, n_points)
+        E, grad, hess, degenerate = perturbative_derivatives(system.hamiltonians(fields[start:stop]), system.M, degeneracy_tol)
+
+        stencil_fallback(lambda stencil, points: system.eigenvalues(stencil), fields[start:stop], step[start:stop], degenerate, grad, hess)
+
+        energies[start:stop] = E
+        gradient[start:stop] = grad
+        hessian[start:stop] = hess
+    energies -= system.ground_energy
+    return energies, gradient, hessian
+
+def transition_pairs(dimension):
+    """
+    (lower, upper) level indices of the ms=0 <-> -1, ms=0 <-> +1 and ms=-1 <-> +1 transition
+    families, each family being the m x m block of level pairs (k, l) with m = dimension / 3
+
+    Returns:
+        ndarray: Level pairs with shape (3 * m * m, 2), ordered by family, then k, then l
+    """
+    m = dimension // 3
+    k, l = np.meshgrid(np.arange(m), np.arange(m), indexing='ij')
+    k, l = k.ravel(), l.ravel()
+    lower = np.concatenate([k, k, m + k])
+    upper = np.concatenate([m + l, 2*m + l, 2*m + l])
+    return np.stack([lower, upper], axis=-1)
+
+def transition_derivatives(energies, gradient, hessian, pairs, chunk_size=None):
+    """
+    Transition energies, gradient norms and mean curvatures for many level pairs at once
+
+    The mean curvature of the iso-frequency surface is (g.H.g - |g|^2 tr H) / (2 |g|^3),
+    with g and H the gradient and Hessian of the transition frequency.
+
+    Args:
+        energies: Energy levels with shape (N, d)
+        gradient: Level gradients with shape (N, d, 3)
+        hessian: Level Hessians with shape (N, d, 3, 3)
+        pairs: (lower, upper) level indices with shape (P, 2)
+        chunk_size: Field points per chunk (default: sized from the number of pairs)
+
+    Returns:
+        Tuple: (transition energies, gradient norms, mean curvatures), each with shape (N, P)
+    """
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    lower, upper = pairs[:, 0], pairs[:, 1]
+    n_points = energies.shape[0]
+    if chunk_size is None:
+        chunk_size = max(1, (64 * 2**20) // (len(pairs) * 13 * 8))
+
+    frequency = np.empty((n_points, len(pairs)))
+    gradient_norm = np.empty_like(frequency)
+    curvature = np.empty_like(frequency)
+    with stage('transitions', n_points):
+        for start in range(0, n_points, chunk_size):
+            chunk = slice(start, min(start + chunk_size, n_points))
+            E, grad, hess = np.asarray(energies[chunk]), np.asarray(gradient[chunk]), np.asarray(hessian[chunk])
+            df = grad[:, upper] - grad[:, lower]
+            d2f = hess[:, upper] - hess[:, lower]
+
+            norm2 = np.einsum('npi,npi->np', df, df)
+            numerator = np.einsum('npi,npij,npj->np', df, d2f, df) - norm2 * np.einsum('npii->np', d2f)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                curvature[chunk] = np.abs(numerator / (2 * norm2**1.5))
+            gradient_norm[chunk] = np.sqrt(norm2)
+            frequency[chunk] = E[:, upper] - E[:, lower]
+    return frequency, gradient_norm, curvature
+
 # mean curvature
-def curvature_transition_energy(system, B_arr, neighbour_arr, generalized_hamiltonian):
-    Energies = energy_curvature(system, B_arr, neighbour_arr, generalized_hamiltonian, n_jobs=-1)
-    # Extract field step sizes from arr (predefined bias fields)
-    delta_Bx, delta_By, delta_Bz = 0.1e-3, 0.1e-3, 0.1e-3  # 0.1e-3
-    
-    # Initialize arrays with proper dimensions
-    array_size = int(Energies.shape[2]/3)
-    Trans_Eng_1 = np.zeros((neighbour_arr.shape[2], array_size, array_size), dtype=np.float32)
-    Trans_Eng_2 = np.zeros((neighbour_arr.shape[2], array_size, array_size), dtype=np.float32)
-    Trans_Eng_3 = np.zeros((neighbour_arr.shape[2], array_size, array_size), dtype=np.float32)
-    gradient1 = np.zeros_like(Trans_Eng_1)
-    gradient2 = np.zeros_like(Trans_Eng_2)
-    gradient3 = np.zeros_like(Trans_Eng_3)
-    curvature1 = np.zeros_like(Trans_Eng_1)
-    curvature2 = np.zeros_like(Trans_Eng_2)
-    curvature3 = np.zeros_like(Trans_Eng_3)
-    # Initialize arrays with proper dimensions
-    array_size = Energies.shape[2] // 3  # Ensuring integer division
-    m = Energies.shape[-1] // 3  # Integer division for valid indexing
-    
-    for k in range(array_size):
-        for l in range(array_size): 
-            # First derivatives (central differences)
-            #for ms=0 to ms=-1 transition
-            df_dBx_1 = ((Energies[:,1,m+l] - Energies[:,2,m+l]) - (Energies[:,1,k] - Energies[:,2,k])) / (2*delta_Bx)
-            df_dBy_1 = ((Energies[:,3,m+l] - Energies[:,4,m+l]) - (Energies[:,3,k] - Energies[:,4,k])) / (2*delta_By)           
-            df_dBz_1 = ((Energies[:,5,m+l] - Energies[:,6,m+l]) - (Energies[:,5,k] - Energies[:,6,k])) / (2*delta_Bz)
-            #for ms=0 to ms=1 transition
-            df_dBx_2 = ((Energies[:,1,(2*m)+l]-Energies[:,1,k])-(Energies[:,2,(2*m)+l]-Energies[:,2,k])) / (2*delta_Bx)
-            df_dBy_2 = ((Energies[:,3,(2*m)+l]-Energies[:,3,k])-(Energies[:,4,(2*m)+l]-Energies[:,4,k])) / (2*delta_By)
-            df_dBz_2 = ((Energies[:,5,(2*m)+l]-Energies[:,5,k])-(Energies[:,6,(2*m)+l]-Energies[:,6,k])) / (2*delta_Bz)
-            #for ms=-1 to ms=1 transition
-            df_dBx_3 = ((Energies[:,1,(2*m)+l]-Energies[:,1,m+k])-(Energies[:,2,(2*m)+l]-Energies[:,2,m+k])) / (2*delta_Bx)
-            df_dBy_3 = ((Energies[:,3,(2*m)+l]-Energies[:,3,m+k])-(Energies[:,4,(2*m)+l]-Energies[:,4,m+k])) / (2*delta_By)
-            df_dBz_3 = ((Energies[:,5,(2*m)+l]-Energies[:,5,m+k])-(Energies[:,6,(2*m)+l]-Energies[:,6,m+k])) / (2*delta_Bz)
-            
-            # Second derivatives (central differences)
-            #for ms=0 to ms=-1 transition
-            d2f_dBx2_1 = ((Energies[:,1,m+l] - 2*Energies[:,0,m+l] + Energies[:,2,m+l]) - (Energies[:,1,k] - 2*Energies[:,0,k] + Energies[:,2,k])) / delta_Bx**2           
-            d2f_dBy2_1 = ((Energies[:,3,m+l] - 2*Energies[:,0,m+l] + Energies[:,4,m+l]) - (Energies[:,3,k] - 2*Energies[:,0,k] + Energies[:,4,k])) / delta_By**2            
-            d2f_dBz2_1 = ((Energies[:,5,m+l] - 2*Energies[:,0,m+l] + Energies[:,6,m+l]) - (Energies[:,5,k] - 2*Energies[:,0,k] + Energies[:,6,k])) / delta_Bz**2
-            #for ms=0 to ms=1 transition
-            d2f_dBx2_2 = ((Energies[:,1,(2*m)+l] - 2*Energies[:,0,(2*m)+l] + Energies[:,2,(2*m)+l]) - (Energies[:,1,k] - 2*Energies[:,0,k] + Energies[:,2,k])) / delta_Bx**2           
-            d2f_dBy2_2 = ((Energies[:,3,(2*m)+l] - 2*Energies[:,0,(2*m)+l] + Energies[:,4,(2*m)+l]) - (Energies[:,3,k] - 2*Energies[:,0,k] + Energies[:,4,k])) / delta_By**2            
-            d2f_dBz2_2 = ((Energies[:,5,(2*m)+l] - 2*Energies[:,0,(2*m)+l] + Energies[:,6,(2*m)+l]) - (Energies[:,5,k] - 2*Energies[:,0,k] + Energies[:,6,k])) / delta_Bz**2
-            #for ms=-1 to ms=1 transition
-            d2f_dBx2_3 = ((Energies[:,1,(2*m)+l] - 2*Energies[:,0,(2*m)+l] + Energies[:,2,(2*m)+l]) - (Energies[:,1,m+k] - 2*Energies[:,0,m+k] + Energies[:,2,m+k])) / delta_Bx**2           
-            d2f_dBy2_3 = ((Energies[:,3,(2*m)+l] - 2*Energies[:,0,(2*m)+l] + Energies[:,4,(2*m)+l]) - (Energies[:,3,m+k] - 2*Energies[:,0,m+k] + Energies[:,4,m+k])) / delta_By**2            
-            d2f_dBz2_3 = ((Energies[:,5,(2*m)+l] - 2*Energies[:,0,(2*m)+l] + Energies[:,6,(2*m)+l]) - (Energies[:,5,m+k] - 2*Energies[:,0,m+k] + Energies[:,6,m+k])) / delta_Bz**2
-            
-            # Cross derivatives (mixed derivatives)
-            #for ms=0 to ms=-1 transition
-            d2f_dBxdBy_1 = ((Energies[:,7,m+l] -  Energies[:,8,m+l] -  Energies[:,9,m+l] +  Energies[:,10,m+l]) - (Energies[:,7,k] -  Energies[:,8,k] -  Energies[:,9,k] +  Energies[:,10,k])) / (4*delta_Bx*delta_By)
-            d2f_dBxdBz_1 = ((Energies[:,11,m+l] - Energies[:,12,m+l] - Energies[:,13,m+l] + Energies[:,14,m+l]) - (Energies[:,11,k] - Energies[:,12,k] - Energies[:,13,k] + Energies[:,14,k])) / (4*delta_Bx*delta_Bz)
-            d2f_dBydBz_1 = ((Energies[:,15,m+l] - Energies[:,16,m+l] - Energies[:,17,m+l] + Energies[:,18,m+l]) - (Energies[:,15,k] - Energies[:,16,k] - Energies[:,17,k] + Energies[:,18,k])) / (4*delta_By*delta_Bz)
-            #for ms=0 to ms=1 transition
-            d2f_dBxdBy_2 = ((Energies[:,7,(2*m)+l] -  Energies[:,8,(2*m)+l] -  Energies[:,9,(2*m)+l] +  Energies[:,10,(2*m)+l]) - (Energies[:,7,k] -  Energies[:,8,k] -  Energies[:,9,k] +  Energies[:,10,k])) / (4*delta_Bx*delta_By)
-            d2f_dBxdBz_2 = ((Energies[:,11,(2*m)+l] - Energies[:,12,(2*m)+l] - Energies[:,13,(2*m)+l] + Energies[:,14,(2*m)+l]) - (Energies[:,11,k] - Energies[:,12,k] - Energies[:,13,k] + Energies[:,14,k])) / (4*delta_Bx*delta_Bz)
-            d2f_dBydBz_2 = ((Energies[:,15,(2*m)+l] - Energies[:,16,(2*m)+l] - Energies[:,17,(2*m)+l] + Energies[:,18,(2*m)+l]) - (Energies[:,15,k] - Energies[:,16,k] - Energies[:,17,k] + Energies[:,18,k])) / (4*delta_By*delta_Bz)
-            #for ms=-1 to ms=1 transition
-            d2f_dBxdBy_3 = ((Energies[:,1,(2*m)+l] - Energies[:,2,(2*m)+l] - Energies[:,3,(2*m)+l] + Energies[:,4,(2*m)+l]) - (Energies[:,1,m+k] - Energies[:,2,m+k] - Energies[:,3,m+k] + Energies[:,4,m+k])) / (4*delta_Bx*delta_By)
-            d2f_dBxdBz_3 = ((Energies[:,1,(2*m)+l] - Energies[:,2,(2*m)+l] - Energies[:,5,(2*m)+l] + Energies[:,6,(2*m)+l]) - (Energies[:,1,m+k] - Energies[:,2,m+k] - Energies[:,5,m+k] + Energies[:,6,m+k])) / (4*delta_Bx*delta_Bz)
-            d2f_dBydBz_3 = ((Energies[:,3,(2*m)+l] - Energies[:,4,(2*m)+l] - Energies[:,5,(2*m)+l] + Energies[:,6,(2*m)+l]) - (Energies[:,3,m+k] - Energies[:,4,m+k] - Energies[:,5,m+k] + Energies[:,6,m+k])) / (4*delta_By*delta_Bz)
-
-            # Curvature calculation
-            numerator1   = (df_dBy_1**2 + df_dBz_1**2) * d2f_dBx2_1 + (df_dBx_1**2 + df_dBz_1**2) * d2f_dBy2_1 + (df_dBx_1**2 + df_dBy_1**2) * d2f_dBz2_1 + 2 * df_dBx_1 * df_dBy_1 * d2f_dBxdBy_1 + 2 * df_dBx_1 * df_dBz_1 * d2f_dBxdBz_1 + 2 * df_dBy_1 * df_dBz_1 * d2f_dBydBz_1
-            denominator1 = 2 * (df_dBx_1**2 + df_dBy_1**2 + df_dBz_1**2)**(1.5)
-            numerator2   = (df_dBy_2**2 + df_dBz_2**2) * d2f_dBx2_2 + (df_dBx_2**2 + df_dBz_2**2) * d2f_dBy2_2 + (df_dBx_2**2 + df_dBy_2**2) * d2f_dBz2_2 + 2 * df_dBx_1 * df_dBy_2 * d2f_dBxdBy_2 + 2 * df_dBx_2 * df_dBz_2 * d2f_dBxdBz_2 + 2 * df_dBy_2 * df_dBz_2 * d2f_dBydBz_2
-            denominator2 = 2 * (df_dBx_2**2 + df_dBy_2**2 + df_dBz_2**2)**(1.5)
-            numerator3   = (df_dBy_3**2 + df_dBz_3**2) * d2f_dBx2_3 + (df_dBx_3**2 + df_dBz_3**2) * d2f_dBy2_3 + (df_dBx_3**2 + df_dBy_3**2) * d2f_dBz2_3 + 2 * df_dBx_3 * df_dBy_3 * d2f_dBxdBy_3 + 2 * df_dBx_3 * df_dBz_3 * d2f_dBxdBz_3 + 2 * df_dBy_3 * df_dBz_3 * d2f_dBydBz_3
-            denominator3 = 2 * (df_dBx_3**2 + df_dBy_3**2 + df_dBz_3**2)**(1.5)
-            
-            # Store results
-            Trans_Eng_1[:,k,l] = Energies[:,0,m+l] - Energies[:,0,k]
-            Trans_Eng_2[:,k,l] = Energies[:,0,(2*m)+l] - Energies[:,0,k]
-            Trans_Eng_3[:,k,l] = Energies[:,0,(2*m)+l] - Energies[:,0,m+k]
-            gradient1[:,k,l] = (np.sqrt(df_dBx_1**2 + df_dBy_1**2 + df_dBz_1**2))
-            gradient2[:,k,l] = (np.sqrt(df_dBx_2**2 + df_dBy_2**2 + df_dBz_2**2))
-            gradient3[:,k,l] = (np.sqrt(df_dBx_3**2 + df_dBy_3**2 + df_dBz_3**2))
-            curvature1[:,k,l] = np.abs(numerator1 / denominator1)
-            curvature2[:,k,l] = np.abs(numerator2 / denominator2)
-            curvature3[:,k,l] = np.abs(numerator3 / denominator3)
-
-    return Trans_Eng_1,gradient1,curvature1,Trans_Eng_2,gradient2,curvature2,Trans_Eng_3,gradient3,curvature3
\ No newline at end of file
+def curvature_transition_energy(system, B_arr, neighbour_arr, generalized_hamiltonian, engine='batched',
+                                derivatives='stencil', delta_B=None, degeneracy_tol=1e-3, transitions=None, Energies=None,
+                                cache=None, progress=None):
+    """
+    Transition energies, gradients and mean curvatures for the ms=0 <-> -1, ms=0 <-> +1 and
+    ms=-1 <-> +1 transition families
+
+    The mean curvature uses the rotation-invariant form of transition_derivatives. Earlier
+    versions had a sign error in the mixed-derivative terms, so maps computed with them differ
+    wherever the frequency gradient is not along a field axis; test_decoherence_mapping.py
+    checks the invariance and the agreement of the stencil and analytic derivatives.
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        B_arr: Central magnetic fields with shape (3, N)
+        neighbour_arr: Neighbour magnetic fields with shape (18, 3, N)
+        generalized_hamiltonian: Hamiltonian builder used by the 'joblib' engine
+        engine: 'batched', 'process' or 'joblib', eigenvalue engine of the stencil derivatives
+            ('joblib' needs an exact system, not a reduced_system)
+        derivatives: 'stencil' (finite differences over neighbour_arr) or 'analytic'
+            (perturbation theory, one diagonalization per point)
+        delta_B: Field step sizes; by default they are read from the grid
+        degeneracy_tol: Level spacing (MHz) below which 'analytic' falls back to the stencil
+        transitions: Optional list of (lower, upper) level pairs to evaluate instead of the
+            three full transition families
+        Energies: Precomputed stencil eigenvalues (N, 19, d), e.g. memory-mapped from a
+            sweep store; they are read chunk by chunk and no eigenvalues are computed
+        cache: Optional result_cache; stencil points already in it are not diagonalized again
+        progress: Optional callback progress(done, total) passed on to the eigenvalue engine
+
+    Returns:
+        Tuple: (Trans_Eng_1, gradient1, curvature1, ..., Trans_Eng_3, gradient3, curvature3),
+        each with shape (N, d/3, d/3). With `transitions`, (Trans_Eng, gradient, curvature)
+        with shape (N, len(transitions)).
+    """
+    with stage('curvature_transition_energy', np.shape(B_arr)[1]):
+        if delta_B is None:
+            delta_B = stencil_step(np.asarray(B_arr, dtype=float), np.asarray(neighbour_arr, dtype=float))
+
+        if derivatives == 'analytic':
+            Energies, grad, hess = analytic_level_derivatives(system, B_arr, delta_B, degeneracy_tol)
+        elif derivatives != 'stencil':
+            raise ValueError(f"Unknown derivatives '{derivatives}'")
+        elif Energies is None:
+            # 'batched' diagonalizes stacked Hamiltonians in-process, 'process' spreads chunks over
+            # a process pool, 'joblib' runs one task per point
+            if cache is not None:
+                from decoherence_mapping_cache import cached_energy_curvature
+                Energies = cached_energy_curvature(system, B_arr, neighbour_arr, cache)
+            elif engine == 'batched':
+                Energies = batched_energy_curvature(system, B_arr, neighbour_arr, progress=progress)
+            elif engine == 'process':
+                from decoherence_mapping_parallel import parallel_energy_curvature
+                Energies, _ = parallel_energy_curvature(system, B_arr, neighbour_arr, progress=progress)
+            elif engine == 'joblib':
+                Energies = energy_curvature(system, B_arr, neighbour_arr, generalized_hamiltonian, n_jobs=-1, progress=progress)
+            else:
+                raise ValueError(f"Unknown engine '{engine}'")
+
+        n_points, d = Energies.shape[0], Energies.shape[-1]
+        pairs = transition_pairs(d) if transitions is None else np.asarray(transitions, dtype=int).reshape(-1, 2)
+        if derivatives == 'analytic':
+            results = tuple(a.astype(np.float32) for a in transition_derivatives(Energies, grad, hess, pairs))
+        else:
+            # Stencil derivatives chunk by chunk, so memory-mapped eigenvalues are only read lazily
+            step = np.broadcast_to(np.asarray(delta_B, dtype=float), (n_points, 3))
+            chunk_size = max(1, (64 * 2**20) // (8 * (31 * d + 13 * len(pairs))))
+            results = tuple(np.empty((n_points, len(pairs)), dtype=np.float32) for _ in range(3))
+            for start in range(0, n_points, chunk_size):
+                chunk = slice(start, min(start + chunk_size, n_points))
+                E = np.asarray(Energies[chunk])
+                grad, hess = stencil_level_derivatives(E, step[chunk])
+                for result, values in zip(results, transition_derivatives(E[:, 0], grad, hess, pairs)):
+                    result[chunk] = values
+
+    if transitions is not None:
+        return results
+
+    m = d // 3
+    # (N, 3 * m * m) -> (3 families, N, m, m)
+    Trans_Eng, gradient, curvature = (a.reshape(-1, 3, m, m).transpose(1, 0, 2, 3) for a in results)
+
+    return Trans_Eng[0],gradient[0],curvature[0],Trans_Eng[1],gradient[1],curvature[1],Trans_Eng[2],gradient[2],curvature[2]
+
+def transition_t2(gradient, hessian, pairs, sigma_B):
+    """
+    T2 estimate 1/T2 = sqrt((|df/dB| sigma_B)^2 + 1/2 (d2f/dB2 sigma_B^2)^2) for level pairs
+
+    For isotropic Gaussian field noise with standard deviation sigma_B per component, the
+    gradient term is |grad f| and d2f/dB2 is the Frobenius norm of the Hessian of f, which
+    gives the variance of the second-order frequency shift exactly.
+
+    Args:
+        gradient: Level gradients with shape (N, d, 3), MHz/T
+        hessian: Level Hessians with shape (N, d, 3, 3), MHz/T^2
+        pairs: (lower, upper) level indices with shape (P, 2)
+        sigma_B: Standard deviation of the field noise (T)
+
+    Returns:
+        ndarray: T2 with shape (N, P), in us for energies in MHz
+    """
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    df = gradient[:, pairs[:, 1]] - gradient[:, pairs[:, 0]]
+    d2f = hessian[:, pairs[:, 1]] - hessian[:, pairs[:, 0]]
+    with stage('t2', len(gradient)):
+        rate2 = np.einsum('npi,npi->np', df, df) * sigma_B**2 + 0.5 * np.einsum('npij,npij->np', d2f, d2f) * sigma_B**4
+        with np.errstate(divide='ignore'):
+            return 1 / np.sqrt(rate2)
+
+def t2_map(system, field_grid, sigma_B, transitions=None, top_k=None, derivatives='analytic',
+           delta_B=0.1e-3, degeneracy_tol=1e-3, chunk_size=None, progress=None):
+    """
+    Streaming T2 map over a field grid
+
+    The grid is processed in chunks: eigenvalues, level derivatives and the T2 estimate of
+    every requested transition are computed per chunk and only the best T2 per point (or the
+    top-k transitions) is kept, so memory scales with the chunk size rather than the grid.
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        field_grid: Magnetic fields with shape (3, N)
+        sigma_B: Standard deviation of the field noise (T)
+        transitions: (lower, upper) level pairs to consider (default: the three ms families)
+        top_k: Keep the k best transitions per point instead of only the best one
+        derivatives: 'analytic' (perturbation theory) or 'stencil' (finite differences);
+            systems that only provide eigenvalues, such as reduced_system, need 'stencil'
+        delta_B: Stencil step size(s) for 'stencil' and the degenerate-level fallback
+        degeneracy_tol: Level spacing (MHz) below which 'analytic' falls back to the stencil
+        chunk_size: Field points per chunk (default: sized from the Hilbert-space dimension)
+        progress: Optional callback progress(done, total), called after every chunk
+
+    Returns:
+        Tuple: (T2, transition index into `transitions`), with shape (N,) or (N, top_k),
+        T2 sorted in decreasing order
+    """
+    system = compile_system(system)
+    if derivatives == 'analytic':
+        require_hamiltonians(system)
+    field_grid = np.asarray(field_grid, dtype=float)
+    n_points, d = field_grid.shape[1], system.dimension
+    pairs = transition_pairs(d) if transitions is None else np.asarray(transitions, dtype=int).reshape(-1, 2)
+    k = 1 if top_k is None else min(top_k, len(pairs))
+    if chunk_size is None:
+        chunk_size = auto_chunk_size(19 if derivatives == 'stencil' else 5, d)
+
+    t2 = np.empty((n_points, k))
+    index = np.empty((n_points, k), dtype=int)
+    with stage('t2_map', n_points):
+        for start in range(0, n_points, chunk_size):
+            stop = min(start + chunk_size, n_points)
+            B = field_grid[:, start:stop]
+            if derivatives == 'analytic':
+                _, grad, hess = analytic_level_derivatives(system, B, delta_B, degeneracy_tol, chunk_size)
+            elif derivatives == 'stencil':
+                step = np.broadcast_to(np.asarray(delta_B, dtype=float), (stop - start, 3))
+                offsets = np.concatenate([np.zeros((stop - start, 1, 3)), stencil_offsets(step)], axis=1)
+                grad, hess = stencil_level_derivatives(system.eigenvalues(B.T[:, None, :] + offsets), step)
+            else:
+                raise ValueError(f"Unknown derivatives '{derivatives}'")
+
+            t2_chunk = transition_t2(grad, hess, pairs, sigma_B)
+            best = np.argpartition(-t2_chunk, k - 1, axis=1)[:, :k] if k < len(pairs) else np.tile(np.arange(len(pairs)), (stop - start, 1))
+            order = np.argsort(-np.take_along_axis(t2_chunk, best, axis=1), axis=1)
+            index[start:stop] = np.take_along_axis(best, order, axis=1)
+            t2[start:stop] = np.take_along_axis(t2_chunk, index[start:stop], axis=1)
+            if progress is not None:
+                progress(stop, n_points)
+
+    if top_k is None:
+        return t2[:, 0], index[:, 0]
+    return t2, index
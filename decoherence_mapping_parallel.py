@@ -0,0 +1,118 @@
+#Chunked process-pool scheduler for the eigenvalue stencil
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from decoherence_mapping_functions import compile_system, stencil_fields, auto_chunk_size
+from decoherence_mapping_profiling import stage
+
+# Environment variables read by the common BLAS/OpenMP runtimes when they are loaded
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                         'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# Per-process state, filled once by _init_worker
+_worker = {}
+
+def _init_worker(system, fields_path, output_path, blas_threads):
+    """Receive the compiled system once and open the memmapped input and output arrays"""
+    try:
+        from threadpoolctl import threadpool_limits
+        # Keep a reference so the limits stay in place for the life of the worker
+        _worker['threadpool_limits'] = threadpool_limits(blas_threads)
+    except ImportError:
+        pass
+    _worker['system'] = system
+    _worker['fields'] = np.load(fields_path, mmap_mode='r')
+    _worker['output'] = np.load(output_path, mmap_mode='r+')
+
+def _run_chunk(start, stop):
+    """Diagonalize one chunk of field points and write it straight into the output array"""
+    t0 = time.perf_counter()
+    system = _worker['system']
+    _worker['output'][start:stop] = system.eigenvalues(_worker['fields'][start:stop]) - system.ground_energy
+    _worker['output'].flush()
+    return {'start': start, 'stop': stop, 'seconds': time.perf_counter() - t0, 'pid': os.getpid()}
+
+class _blas_threads_environment:
+    """Temporarily set the BLAS thread variables so that spawned workers inherit them"""
+    def __init__(self, n_threads):
+        self.n_threads = str(n_threads)
+        self.saved = {}
+
+    def __enter__(self):
+        for name in BLAS_THREAD_VARIABLES:
+            self.saved[name] = os.environ.get(name)
+            os.environ[name] = self.n_threads
+        return self
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def parallel_energy_curvature(system, B_arr, neighbour_arr, n_jobs=-1, chunk_size=None, blas_threads=1, temp_folder=None,
+                              progress=None):
+    """
+    Eigenvalue stencil for every field point on a pool of worker processes
+
+    The compiled system is sent once to each worker, the grid is split into chunks and every
+    worker writes its eigenvalues directly into a memory-mapped output array, so only chunk
+    boundaries travel through the task queue. Workers are started with the 'spawn' method so
+    that they pick up the BLAS thread limit, which means scripts calling this function need
+    an `if __name__ == '__main__':` guard.
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        B_arr: Central magnetic fields with shape (3, N)
+        neighbour_arr: Neighbour magnetic fields with shape (K, 3, N)
+        n_jobs: Number of worker processes (-1 for all cores)
+        chunk_size: Field points per task (default: a few tasks per worker, capped in memory)
+        blas_threads: BLAS threads per worker, to avoid oversubscribing the cores
+        temp_folder: Directory for the memory-mapped arrays (default: system temp directory)
+        progress: Optional callback progress(done, total), called as chunks complete
+
+    Returns:
+        Tuple: (eigenvalues with shape (N, K + 1, d), list of per-chunk timing dicts with
+        'start', 'stop', 'seconds' and 'pid')
+    """
+    system = compile_system(system)
+    system.ground_energy  # computed once here rather than in every worker
+    fields = stencil_fields(np.asarray(B_arr, dtype=float), np.asarray(neighbour_arr, dtype=float))
+    n_points = fields.shape[0]
+    if n_points == 0:
+        return np.empty(fields.shape[:2] + (system.dimension,)), []
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    if chunk_size is None:
+        chunk_size = max(1, min(auto_chunk_size(fields.shape[1], system.dimension), -(-n_points // (4 * n_jobs))))
+
+    folder = tempfile.mkdtemp(prefix='decoherence_mapping_', dir=temp_folder)
+    try:
+        fields_path = os.path.join(folder, 'fields.npy')
+        output_path = os.path.join(folder, 'eigenvalues.npy')
+        np.save(fields_path, fields)
+        np.lib.format.open_memmap(output_path, mode='w+', dtype=float, shape=fields.shape[:2] + (system.dimension,)).flush()
+
+        timings = []
+        with stage('dispatch', n_points), _blas_threads_environment(blas_threads):
+            # Spawned workers load NumPy, and with it BLAS, after the thread variables are set;
+            # forked workers would inherit the parent's already initialised BLAS and ignore them
+            with ProcessPoolExecutor(n_jobs, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+                                     initargs=(system, fields_path, output_path, blas_threads)) as pool:
+                futures = [pool.submit(_run_chunk, start, min(start + chunk_size, n_points))
+                           for start in range(0, n_points, chunk_size)]
+                for future in as_completed(futures):
+                    timings.append(future.result())
+                    if progress is not None:
+                        progress(sum(t['stop'] - t['start'] for t in timings), n_points)
+
+        eigenvalues = np.array(np.load(output_path, mmap_mode='r'))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    timings.sort(key=lambda t: t['start'])
+    return eigenvalues, timings
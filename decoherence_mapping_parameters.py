@@ -1,223 +1,142 @@
-from qutip import jmat
+import json
+import os
+from functools import lru_cache
+import numpy as np
+
+# Default species table shipped with the module
+SPECIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'decoherence_mapping_species.json')
+
+@lru_cache(maxsize=None)
+def spin_operators(spin):
+    """Spin operators (Jx, Jy, Jz) for spin quantum number `spin`, built once per value"""
+    from qutip import jmat
+    return jmat(spin, 'x'), jmat(spin, 'y'), jmat(spin, 'z')
+
+def _frozen_tensor(values):
+    tensor = np.array(values, dtype=float).reshape(3, 3)
+    tensor.setflags(write=False)
+    return tensor
+
+class _species:
+    """Immutable record with __slots__; fields are set once in __init__"""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"'{type(self).__name__}' records are immutable, use replace()")
+
+    def _set(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def replace(self, **changes):
+        """Copy of the record with some fields changed, e.g. nuclear('NV_13C').replace(A=...)"""
+        fields = {name: getattr(self, name) for name in self._fields}
+        if 'spin' in changes and 'dimension' not in changes:
+            # The stored dimension belongs to the old spin, let __init__ derive the new one
+            fields['dimension'] = None
+        fields.update(changes)
+        return type(self)(**fields)
+
+    def __reduce__(self):
+        # Rebuild through __init__ so that copies and pickles respect immutability
+        return type(self), tuple(getattr(self, name) for name in self._fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
 
 # Nuclear spin system with hyperfine and quadrupole parameters
-class nuclear:
-    def __init__(self, name):
-        self.name = name
-        
-        if self.name == 'NV_14N':
-            self.A_xx = 2.7    # MHz
-            self.A_yy = 2.7    # MHz
-            self.A_zz = 2.14   # MHz
-            self.A_xy = 0      # MHz
-            self.A_yx = 0      # MHz
-            self.A_xz = 0      # MHz
-            self.A_zx = 0      # MHz
-            self.A_yz = 0      # MHz
-            self.A_zy = 0      # MHz
-            self.Q_xx = 0      # MHz
-            self.Q_yy = 0      # MHz
-            self.Q_zz = 0      # MHz
-            self.Q_xy = 0      # MHz
-            self.Q_yx = 0      # MHz
-            self.Q_xz = 0      # MHz
-            self.Q_zx = 0      # MHz
-            self.Q_yz = 0      # MHz
-            self.Q_zy = 0      # MHz
-            self.g = 3.0766    # MHz/T
-            self.Iz = jmat(3,'z')
-            self.Iy = jmat(3,'y')
-            self.Ix = jmat(3,'x')
-            self.dimension = 7
-        
-        elif self.name == 'NV_15N':
-            self.A_xx = 3.65   # MHz
-            self.A_yy = 3.65   # MHz
-            self.A_zz = 3.03   # MHz
-            self.A_xy = 0      # MHz
-            self.A_yx = 0      # MHz
-            self.A_xz = 0      # MHz
-            self.A_zx = 0      # MHz
-            self.A_yz = 0      # MHz
-            self.A_zy = 0      # MHz
-            self.Q_xx = 0      # MHz
-            self.Q_yy = 0      # MHz
-            self.Q_zz = 0      # MHz
-            self.Q_xy = 0      # MHz
-            self.Q_yx = 0      # MHz
-            self.Q_xz = 0      # MHz
-            self.Q_zx = 0      # MHz
-            self.Q_yz = 0      # MHz
-            self.Q_zy = 0      # MHz
-            self.g = 4.3156    # MHz/T
-            self.Iz = jmat(1/2,'z')
-            self.Iy = jmat(1/2,'y')
-            self.Ix = jmat(1/2,'x')
-            self.dimension = 2
-
-        elif self.name == 'NV_13C':
-            self.A_xx = 0.5    # MHz
-            self.A_yy = 0.5    # MHz
-            self.A_zz = 0.5    # MHz
-            self.A_xy = 0      # MHz
-            self.A_yx = 0      # MHz
-            self.A_xz = 0      # MHz
-            self.A_zx = 0      # MHz
-            self.A_yz = 0      # MHz
-            self.A_zy = 0      # MHz
-            self.Q_xx = 0      # MHz
-            self.Q_yy = 0      # MHz
-            self.Q_zz = 0      # MHz
-            self.Q_xy = 0      # MHz
-            self.Q_yx = 0      # MHz
-            self.Q_xz = 0      # MHz
-            self.Q_zx = 0      # MHz
-            self.Q_yz = 0      # MHz
-            self.Q_zy = 0      # MHz
-            self.g = 10.7084   # MHz/T
-            self.Iz = jmat(1/2,'z')
-            self.Iy = jmat(1/2,'y')
-            self.Ix = jmat(1/2,'x')
-            self.dimension = 2
-
-        elif self.name == 'VB_14N1':
-            self.A_xx = 46.944   # MHz
-            self.A_yy = 90.025   # MHz
-            self.A_zz = 48.158   # MHz
-            self.A_xy = 0        # MHz
-            self.A_yx = 0        # MHz
-            self.A_xz = 0        # MHz
-            self.A_zx = 0        # MHz
-            self.A_yz = 0        # MHz
-            self.A_zy = 0        # MHz
-            self.Q_xx = -0.46    # MHz
-            self.Q_yy = 0.98     # MHz
-            self.Q_zz = -0.52    # MHz
-            self.Q_xy = 0        # MHz
-            self.Q_yx = 0        # MHz
-            self.Q_xz = 0        # MHz
-            self.Q_zx = 0        # MHz
-            self.Q_yz = 0        # MHz
-            self.Q_zy = 0        # MHz
-            self.g = 3.0766      # MHz/T
-            self.Iz = jmat(1,'z')
-            self.Iy = jmat(1,'y')
-            self.Ix = jmat(1,'x')
-            self.dimension = 3
-
-        elif self.name == 'VB_14N2':
-            self.A_xx = 79.406   # MHz
-            self.A_yy = 58.170   # MHz
-            self.A_zz = 48.159   # MHz
-            self.A_xy = -18.391  # MHz
-            self.A_yx = -18.391  # MHz
-            self.A_xz = 0        # MHz
-            self.A_zx = 0        # MHz
-            self.A_yz = 0        # MHz
-            self.A_zy = 0        # MHz
-            self.Q_xx = 0.62     # MHz
-            self.Q_yy = -0.1     # MHz
-            self.Q_zz = -0.52    # MHz
-            self.Q_xy = -0.623   # MHz
-            self.Q_yx = -0.623    # MHz
-            self.Q_xz = 0        # MHz
-            self.Q_zx = 0        # MHz
-            self.Q_yz = 0        # MHz
-            self.Q_zy = 0        # MHz
-            self.g = 3.0766      # MHz/T
-            self.Iz = jmat(1,'z')
-            self.Iy = jmat(1,'y')
-            self.Ix = jmat(1,'x')
-            self.dimension = 3
-
-        elif self.name == 'VB_14N3':
-            self.A_xx = 79.406   # MHz
-            self.A_yy = 58.170   # MHz
-            self.A_zz = 48.159   # MHz
-            self.A_xy = 18.391   # MHz
-            self.A_yx = 18.391   # MHz
-            self.A_xz = 0        # MHz
-            self.A_zx = 0        # MHz
-            self.A_yz = 0        # MHz
-            self.A_zy = 0        # MHz
-            self.Q_xx = 0.62     # MHz
-            self.Q_yy = -0.1     # MHz
-            self.Q_zz = -0.52    # MHz
-            self.Q_xy = 0.623    # MHz
-            self.Q_yx = 0.623    # MHz
-            self.Q_xz = 0        # MHz
-            self.Q_zx = 0        # MHz
-            self.Q_yz = 0        # MHz
-            self.Q_zy = 0        # MHz
-            self.g = 3.0766      # MHz/T
-            self.Iz = jmat(1,'z')
-            self.Iy = jmat(1,'y')
-            self.Ix = jmat(1,'x')
-            self.dimension = 3
-
-        elif self.name == 'None':
-            self.A_xx = 0      # MHz
-            self.A_yy = 0      # MHz
-            self.A_zz = 0      # MHz
-            self.A_xy = 0      # MHz
-            self.A_yx = 0      # MHz
-            self.A_xz = 0      # MHz
-            self.A_zx = 0      # MHz
-            self.A_yz = 0      # MHz
-            self.A_zy = 0      # MHz
-            self.Q_xx = 0      # MHz
-            self.Q_yy = 0      # MHz
-            self.Q_zz = 0      # MHz
-            self.Q_xy = 0      # MHz
-            self.Q_yx = 0      # MHz
-            self.Q_xz = 0      # MHz
-            self.Q_zx = 0      # MHz
-            self.Q_yz = 0      # MHz
-            self.Q_zy = 0      # MHz
-            self.g = 0
-            self.Iz = jmat(0,'z')
-            self.Iy = jmat(0,'y')
-            self.Ix = jmat(0,'x')
-            self.dimension = 0
+class nuclear_species(_species):
+    """
+    Args:
+        name: Species name
+        A: Hyperfine tensor (3x3, MHz)
+        Q: Quadrupole tensor (3x3, MHz)
+        g: Gyromagnetic ratio (MHz/T)
+        spin: Spin quantum number
+        dimension: Hilbert-space dimension (default: 2 * spin + 1)
+    """
+    __slots__ = ('name', 'A', 'Q', 'g', 'spin', 'dimension')
+    _fields = __slots__
+
+    def __init__(self, name, A, Q, g, spin, dimension=None):
+        self._set(name=name, A=_frozen_tensor(A), Q=_frozen_tensor(Q), g=float(g), spin=spin,
+                  dimension=int(round(2 * spin + 1)) if dimension is None else dimension)
+
+    @property
+    def Ix(self):
+        return spin_operators(self.spin)[0]
+
+    @property
+    def Iy(self):
+        return spin_operators(self.spin)[1]
 
+    @property
+    def Iz(self):
+        return spin_operators(self.spin)[2]
+
+    def __getattr__(self, name):
+        # Component access of the former per-attribute classes, e.g. A_xy -> A[0, 1]
+        if len(name) == 4 and name[:2] in ('A_', 'Q_') and set(name[2:]) <= set('xyz'):
+            return float(getattr(self, name[0])['xyz'.index(name[2]), 'xyz'.index(name[3])])
+        raise AttributeError(name)
 
 # Electronic spin system with Zeeman and zero-field splitting parameters
-class electronic:
-    def __init__(self, name):
-        self.name = name
-
-        if self.name == 'electron':
-            self.D = 0            # MHz
-            self.E = 0 
-            self.g = -28025       # MHz/T
-            self.Sz = jmat(1/2,'z')
-            self.Sy = jmat(1/2,'y')
-            self.Sx = jmat(1/2,'x')
-            self.dimension = 2
-
-        elif self.name == 'NV-':
-            self.D = 2878         # MHz
-            self.E = 0 
-            self.g = -28025       # MHz/T
-            self.Sz = jmat(1,'z')
-            self.Sy = jmat(1,'y')
-            self.Sx = jmat(1,'x')
-            self.dimension = 3
-
-        elif self.name == 'VB-':
-            self.D = 3450         # MHz (formerly 3476)
-            self.E = 0            # MHz (strain-induced splitting)
-            self.g = -28025       # MHz/T
-            self.Sz = jmat(1,'z')
-            self.Sy = jmat(1,'y')
-            self.Sx = jmat(1,'x')
-            self.dimension = 3
-
-        elif self.name == 'None':
-            self.D = 0
-            self.E = 0 
-            self.g = 0
-            self.Sz = jmat(0,'z')
-            self.Sy = jmat(0,'y')
-            self.Sx = jmat(0,'x')
-            self.dimension = 0
\ No newline at end of file
+class electronic_species(_species):
+    """
+    Args:
+        name: Species name
+        D: Zero-field splitting (MHz)
+        E: Transverse zero-field splitting (MHz)
+        g: Gyromagnetic ratio (MHz/T)
+        spin: Spin quantum number
+        dimension: Hilbert-space dimension (default: 2 * spin + 1)
+    """
+    __slots__ = ('name', 'D', 'E', 'g', 'spin', 'dimension')
+    _fields = __slots__
+
+    def __init__(self, name, D, E, g, spin, dimension=None):
+        self._set(name=name, D=float(D), E=float(E), g=float(g), spin=spin,
+                  dimension=int(round(2 * spin + 1)) if dimension is None else dimension)
+
+    @property
+    def Sx(self):
+        return spin_operators(self.spin)[0]
+
+    @property
+    def Sy(self):
+        return spin_operators(self.spin)[1]
+
+    @property
+    def Sz(self):
+        return spin_operators(self.spin)[2]
+
+# Registries of known species, filled from SPECIES_FILE and register_species
+ELECTRONIC = {}
+NUCLEAR = {}
+
+def register_species(path):
+    """
+    Add the species of a JSON data file to the registries (existing names are replaced)
+
+    The file holds an "electronic" and a "nuclear" table keyed by species name, with the
+    constructor arguments of electronic_species and nuclear_species as fields; a "note"
+    field is allowed for free-text remarks.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    for name, fields in data.get('electronic', {}).items():
+        fields = {key: value for key, value in fields.items() if key != 'note'}
+        ELECTRONIC[name] = electronic_species(name, **fields)
+    for name, fields in data.get('nuclear', {}).items():
+        fields = {key: value for key, value in fields.items() if key != 'note'}
+        NUCLEAR[name] = nuclear_species(name, **fields)
+
+register_species(SPECIES_FILE)
+
+def nuclear(name):
+    """Registered nuclear spin system, e.g. nuclear('VB_14N1')"""
+    return NUCLEAR[name]
+
+def electronic(name):
+    """Registered electronic spin system, e.g. electronic('VB-')"""
+    return ELECTRONIC[name]
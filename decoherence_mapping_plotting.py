@@ -0,0 +1,67 @@
+#Plotly visualization of field maps, kept apart from the compute modules
+#Plotly is imported inside the functions, so importing this module is cheap as well
+import numpy as np
+
+def field_map_figure(field_grid, values, title=None, colorbar_title=None, log=False, marker_size=3, colorscale='Viridis'):
+    """
+    3D scatter of a quantity over the field points, coloured by value
+
+    Args:
+        field_grid: Magnetic fields with shape (3, N), in T (plotted in mT)
+        values: Quantity per field point with shape (N,), e.g. the T2 returned by t2_map
+        title: Figure title
+        colorbar_title: Title of the colour bar
+        log: Colour by log10 of the values
+        marker_size: Marker size
+        colorscale: Plotly colour scale
+
+    Returns:
+        plotly.graph_objs.Figure
+    """
+    from plotly import graph_objs as go
+
+    fig = go.Figure(_scatter(field_grid, values, log, marker_size, colorscale, colorbar_title))
+    fig.update_layout(title=title, scene=_scene())
+    return fig
+
+def transition_family_figure(field_grid, maps, titles=('ms=0 <-> -1', 'ms=0 <-> +1', 'ms=-1 <-> +1'),
+                             log=False, marker_size=3, colorscale='Viridis'):
+    """
+    Side-by-side 3D scatters of one quantity per transition family
+
+    Args:
+        field_grid: Magnetic fields with shape (3, N), in T (plotted in mT)
+        maps: One array of shape (N,) per family, e.g. the lowest curvature per point of the
+            three families returned by curvature_transition_energy
+        titles: Subplot titles
+        log: Colour by log10 of the values
+        marker_size: Marker size
+        colorscale: Plotly colour scale
+
+    Returns:
+        plotly.graph_objs.Figure
+    """
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(rows=1, cols=len(maps), specs=[[{'type': 'scene'}] * len(maps)], subplot_titles=titles)
+    for col, values in enumerate(maps, start=1):
+        trace = _scatter(field_grid, values, log, marker_size, colorscale, None)
+        # One colour bar per subplot, placed under its scene
+        trace.marker.colorbar = dict(orientation='h', x=(col - 0.5) / len(maps), len=0.8 / len(maps), y=-0.1)
+        fig.add_trace(trace, row=1, col=col)
+    fig.update_scenes(_scene())
+    return fig
+
+def _scatter(field_grid, values, log, marker_size, colorscale, colorbar_title):
+    from plotly import graph_objs as go
+
+    B = 1e3 * np.asarray(field_grid, dtype=float)
+    values = np.asarray(values, dtype=float)
+    colour = np.log10(values) if log else values
+    return go.Scatter3d(x=B[0], y=B[1], z=B[2], mode='markers', customdata=values,
+                        hovertemplate='B = (%{x:.3g}, %{y:.3g}, %{z:.3g}) mT<br>%{customdata:.4g}<extra></extra>',
+                        marker=dict(size=marker_size, color=colour, colorscale=colorscale,
+                                    colorbar=dict(title=colorbar_title)))
+
+def _scene():
+    return dict(xaxis_title='Bx (mT)', yaxis_title='By (mT)', zaxis_title='Bz (mT)', aspectmode='data')
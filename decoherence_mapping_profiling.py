@@ -0,0 +1,119 @@
+#Opt-in per-stage profiling: wall time, call counts, peak memory and throughput
+#
+#The compute functions mark their stages with `with stage('eigensolve', points):`. Outside a
+#profiler this is a no-op, so there is no cost unless profiling is switched on:
+#
+#   with profiler() as prof:
+#       t2_map(system, field_grid, sigma_B)
+#   prof.report()
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Profiler collecting the stages, None when profiling is off
+_active = None
+
+class profiler:
+    """
+    Collects the stages run inside its `with` block
+
+    Stages are aggregated by name. Seconds are inclusive, i.e. they contain the nested stages
+    (a 'compile' stage contains the 'operators' and 'hamiltonian' stages run while compiling).
+    Peak memory is the largest increase of traced Python/NumPy allocations over the start of
+    a stage, nested stages included; memory held by BLAS/LAPACK workspaces is not traced.
+
+    Args:
+        memory: Trace allocations with tracemalloc for the peak memory (slows down
+            allocation-heavy code, so it can be switched off for pure timing runs)
+    """
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.stages = {}
+        self._stack = []
+        self._started_tracing = False
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        self.seconds = time.perf_counter() - self._started
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        _active = self._previous
+        return False
+
+    def _enter_stage(self, name):
+        current = 0
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # Close the running peak of the enclosing stage before the nested one resets it
+                self._stack[-1][3] = max(self._stack[-1][3], peak - self._stack[-1][2])
+            tracemalloc.reset_peak()
+        self._stack.append([name, time.perf_counter(), current, 0])
+
+    def _exit_stage(self, points):
+        name, started, start_memory, peak = self._stack.pop()
+        seconds = time.perf_counter() - started
+        if self.memory:
+            peak_absolute = tracemalloc.get_traced_memory()[1]
+            peak = max(peak, peak_absolute - start_memory)
+            tracemalloc.reset_peak()
+            if self._stack:
+                # Pass this stage's own peak up, which includes the peaks of its nested stages
+                # (their exits reset the tracemalloc peak, so peak_absolute alone would miss them)
+                self._stack[-1][3] = max(self._stack[-1][3], peak + start_memory - self._stack[-1][2])
+
+        record = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0, 'points': 0})
+        record['calls'] += 1
+        record['seconds'] += seconds
+        record['peak_bytes'] = max(record['peak_bytes'], peak)
+        record['points'] += points
+
+    def report(self):
+        """
+        Dict of the stages, each with 'calls', 'seconds', 'peak_bytes' (None without memory
+        tracing), 'points' and 'points_per_second' (None for stages without points)
+        """
+        report = {}
+        for name, record in self.stages.items():
+            record = dict(record)
+            record['points_per_second'] = record['points'] / record['seconds'] if record['points'] and record['seconds'] else None
+            if not self.memory:
+                record['peak_bytes'] = None
+            report[name] = record
+        return report
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+@contextmanager
+def stage(name, points=0):
+    """
+    Mark a stage of the computation for the active profiler (no-op without one)
+
+    Args:
+        name: Stage name, e.g. 'hamiltonian' or 'eigensolve'
+        points: Number of items handled by this call, for the throughput: field points, or
+            Hamiltonians for the 'hamiltonian', 'eigensolve' and perturbative 'derivatives' stages
+    """
+    if _active is None:
+        yield
+        return
+    profile = _active
+    profile._enter_stage(name)
+    try:
+        yield
+    finally:
+        profile._exit_stage(points)
@@ -0,0 +1,166 @@
+#Electron-spin-manifold block reduction for large nuclear baths
+import numpy as np
+import scipy.sparse as sp
+from decoherence_mapping_functions import nuclear_tensors
+
+def _sparse_single_spin(matrix, i, dims):
+    """Sparse operator of nucleus i embedded in the nuclear Hilbert space"""
+    before, after = int(np.prod(dims[:i])), int(np.prod(dims[i + 1:]))
+    return sp.kron(sp.kron(sp.identity(before, format='csr'), sp.csr_matrix(matrix)), sp.identity(after, format='csr'), format='csr')
+
+class reduced_system:
+    """
+    Block-reduced solver for a central spin with large zero-field splitting and a nuclear bath
+
+    The electron part H_e(B) = D(Sz^2 - 2/3) + E(Sy^2 - Sx^2) - g B.S is diagonalized first;
+    its levels define the electron manifolds. Levels closer than `coupling_ratio` times the
+    hyperfine scale are merged into one block. Each block gets a second-order
+    Schrieffer-Wolff effective Hamiltonian on (block levels) x (nuclear space),
+
+        H_ab = delta_ab (e_a + H_n) + V_ab + 1/2 sum_c V_ac V_cb (1/(e_a - e_c) + 1/(e_b - e_c)),
+
+    with V_ab = sum_i <a|S_i|b> T_i, T_i = sum_k A_k[i, :].I_k and c running over the levels
+    outside the block. Only the blocks are diagonalized, which is (d/d_block)^2 times cheaper
+    than the full problem. Nuclear operators, T_i and the products T_i T_j are kept sparse.
+
+    It provides the eigenvalues interface of compiled_system (eigenvalues, ground_energy,
+    dimension), so it can be passed to batched_energy_curvature, t2_map(derivatives='stencil')
+    and the sweep runners in place of a compiled system. It has no Hamiltonian stack, so the
+    analytic derivatives raise a ValueError.
+
+    Args:
+        electron: Central spin system with parameters
+        nuclei: List of nuclear spin systems with parameters
+        coupling_ratio: Electron levels closer than this times the hyperfine scale share a block
+    """
+    solver = 'reduced'
+
+    def __init__(self, electron, nuclei, coupling_ratio=10):
+        self.electron = electron
+        self.nuclei = list(nuclei)
+        self.coupling_ratio = coupling_ratio
+
+        self.S = np.stack([electron.Sx.full(), electron.Sy.full(), electron.Sz.full()])
+        Sx, Sy, Sz = self.S
+        self.H_e_static = electron.D * (Sz @ Sz - 2/3 * np.eye(len(Sz))) + electron.E * (Sy @ Sy - Sx @ Sx)
+
+        dims = [nuc.dimension for nuc in self.nuclei]
+        self.nuclear_dimension = int(np.prod(dims))
+        self.dimension = electron.dimension * self.nuclear_dimension
+
+        # Nuclear quadrupole part, nuclear Zeeman matrices and hyperfine operators T_i
+        zero = sp.csr_matrix((self.nuclear_dimension, self.nuclear_dimension), dtype=complex)
+        self.H_n_static = zero.copy()
+        self.Z = [zero.copy() for _ in range(3)]
+        self.T = [zero.copy() for _ in range(3)]
+        for k, nuc in enumerate(self.nuclei):
+            I = [_sparse_single_spin(op.full(), k, dims) for op in (nuc.Ix, nuc.Iy, nuc.Iz)]
+            A, Q = nuclear_tensors(nuc)
+            for i in range(3):
+                self.Z[i] = self.Z[i] + nuc.g * I[i]
+                for j in range(3):
+                    self.T[i] = self.T[i] + A[i, j] * I[j]
+                    self.H_n_static = self.H_n_static + Q[i, j] * (I[i] @ I[j])
+        self.TT = [[(self.T[i] @ self.T[j]).tocsr() for j in range(3)] for i in range(3)]
+
+        # Largest hyperfine row sum, an upper bound of |T_i|
+        self.hyperfine_scale = max(abs(T).sum(axis=1).max() for T in self.T) if self.nuclei else 0.0
+        # Upper bound of |V| = |sum_i S_i T_i|, the coupling scale of the error estimate
+        self.coupling_scale = sum(np.linalg.norm(S, 2) * abs(T).sum(axis=1).max() for S, T in zip(self.S, self.T)) if self.nuclei else 0.0
+        self._ground_energy = None
+
+    def fingerprint_parameters(self):
+        """Solver settings that change the eigenvalues, hashed by system_fingerprint"""
+        return (self.coupling_ratio,)
+
+    def electron_levels(self, B):
+        """Electron energies (de,) and eigenvectors (de, de) at field B"""
+        return np.linalg.eigh(self.H_e_static - self.electron.g * np.tensordot(B, self.S, axes=(0, 0)))
+
+    def blocks(self, e):
+        """Group sorted electron levels whose spacing is below coupling_ratio * hyperfine_scale"""
+        split = np.flatnonzero(np.diff(e) >= self.coupling_ratio * self.hyperfine_scale) + 1
+        return np.split(np.arange(len(e)), split)
+
+    def block_hamiltonian(self, B, e, s, block):
+        """Dense effective Hamiltonian of one block, given electron energies e and S_i in their eigenbasis s"""
+        outside = np.setdiff1d(np.arange(len(e)), block)
+        H_n = self.H_n_static - sum(B[i] * self.Z[i] for i in range(3))
+        identity = sp.identity(self.nuclear_dimension, format='csr')
+
+        rows = []
+        for a in block:
+            row = []
+            for b in block:
+                H_ab = sum(s[i, a, b] * self.T[i] for i in range(3))
+                if a == b:
+                    H_ab = H_ab + e[a] * identity + H_n
+                if outside.size:
+                    w = 0.5 * (1 / (e[a] - e[outside]) + 1 / (e[b] - e[outside]))
+                    # sum_c s_i[a, c] s_j[c, b] w_c for all (i, j)
+                    c = np.einsum('ic,jc,c->ij', s[:, a, outside], s[:, outside, b], w)
+                    H_ab = H_ab + sum(c[i, j] * self.TT[i][j] for i in range(3) for j in range(3))
+                row.append(H_ab)
+            rows.append(row)
+        return sp.bmat(rows, format='csr').toarray()
+
+    def eigenvalues(self, fields):
+        """Sorted approximate eigenvalues with shape (..., d) for a stack of fields (..., 3)"""
+        fields = np.asarray(fields, dtype=float)
+        flat = fields.reshape(-1, 3)
+        eigenvalues = np.empty((len(flat), self.dimension))
+        for n, B in enumerate(flat):
+            e, U = self.electron_levels(B)
+            s = U.conj().T[None] @ self.S @ U[None]
+            eigenvalues[n] = np.sort(np.concatenate([np.linalg.eigvalsh(self.block_hamiltonian(B, e, s, block))
+                                                     for block in self.blocks(e)]))
+        return eigenvalues.reshape(fields.shape[:-1] + (self.dimension,))
+
+    @property
+    def ground_energy(self):
+        """Lowest zero-field eigenvalue, used as the energy reference (computed once)"""
+        if self._ground_energy is None:
+            self._ground_energy = self.eigenvalues(np.zeros(3))[0]
+        return self._ground_energy
+
+    def exact_hamiltonian(self, B):
+        """Full sparse Hamiltonian at field B, built from the same operators without any reduction"""
+        identity = sp.identity(self.nuclear_dimension, format='csr')
+        H_e = self.H_e_static - self.electron.g * np.tensordot(B, self.S, axes=(0, 0))
+        H = sp.kron(H_e, identity) + sp.kron(np.eye(len(H_e)), self.H_n_static - sum(B[i] * self.Z[i] for i in range(3)))
+        for i in range(3):
+            H = H + sp.kron(self.S[i], self.T[i])
+        return H.tocsr()
+
+    def error_estimate(self, fields):
+        """
+        A-priori size (MHz) of the neglected third-order terms, coupling_scale^3 / gap^2 with
+        coupling_scale an upper bound of the electron-nuclear coupling |V| and gap the smallest
+        spacing between electron levels of different blocks, per field
+        """
+        flat = np.asarray(fields, dtype=float).reshape(-1, 3)
+        estimate = np.zeros(len(flat))
+        for n, B in enumerate(flat):
+            e, _ = self.electron_levels(B)
+            blocks = self.blocks(e)
+            if len(blocks) > 1:
+                gap = min(e[blocks[k + 1][0]] - e[blocks[k][-1]] for k in range(len(blocks) - 1))
+                estimate[n] = self.coupling_scale**3 / gap**2
+        return estimate.reshape(np.shape(fields)[:-1])
+
+def reduced_solver_error(system, fields):
+    """
+    Largest deviation (MHz) of the reduced eigenvalues from the exact dense eigenvalues
+
+    Intended for a handful of representative fields, since the exact problem is solved densely.
+
+    Args:
+        system: reduced_system
+        fields: Magnetic fields with shape (n, 3)
+
+    Returns:
+        ndarray: Maximum absolute eigenvalue error per field, shape (n,)
+    """
+    fields = np.asarray(fields, dtype=float).reshape(-1, 3)
+    exact = np.array([np.linalg.eigvalsh(system.exact_hamiltonian(B).toarray()) for B in fields])
+    return np.abs(system.eigenvalues(fields) - exact).max(axis=-1)
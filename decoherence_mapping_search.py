@@ -0,0 +1,130 @@
+#Adaptive search for low-gradient, low-curvature (long T2) field orientations
+import numpy as np
+from decoherence_mapping_functions import compile_system, transition_pairs, t2_map
+
+def spherical_to_field(r, theta, phi):
+    """Field vectors (..., 3) from magnitude, polar and azimuthal angle"""
+    r, theta, phi = np.broadcast_arrays(r, theta, phi)
+    return np.stack([r * np.sin(theta) * np.cos(phi), r * np.sin(theta) * np.sin(phi), r * np.cos(theta)], axis=-1)
+
+class _t2_evaluator:
+    """Memoized best-transition T2 at (r, theta, phi) points, evaluated in batches"""
+    def __init__(self, system, sigma_B, transitions, **t2_options):
+        self.system = system
+        self.sigma_B = sigma_B
+        self.transitions = transitions
+        self.t2_options = t2_options
+        self.values = {}
+
+    @staticmethod
+    def key(point):
+        r, theta = np.round(point[:2], 12)
+        # phi and phi + 2 pi are the same field; the second modulo folds values just below 2 pi
+        phi = np.round(np.mod(point[2], 2 * np.pi), 12) % np.round(2 * np.pi, 12) + 0.0
+        # all azimuths describe the same field at the poles
+        return (r, theta, 0.0 if theta in (0.0, np.round(np.pi, 12)) else phi)
+
+    def __call__(self, points):
+        """T2 and transition index for (n, 3) points of (r, theta, phi)"""
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        new = {self.key(p): p for p in points if self.key(p) not in self.values}
+        if new:
+            todo = np.array(list(new.values()))
+            fields = spherical_to_field(todo[:, 0], todo[:, 1], todo[:, 2]).T
+            t2, index = t2_map(self.system, fields, self.sigma_B, self.transitions, **self.t2_options)
+            self.values.update(zip(new, zip(t2, index)))
+        return np.array([self.values[self.key(p)] for p in points]).reshape(-1, 2).T
+
+    @property
+    def evaluations(self):
+        return len(self.values)
+
+def _select_candidates(points, t2, n_candidates, min_separation):
+    """Greedy pick of the best points that are at least `min_separation` (rad) apart on the same shell"""
+    order = np.argsort(-t2)
+    directions = spherical_to_field(1, points[:, 1], points[:, 2])
+    chosen = []
+    for i in order:
+        if all(points[j, 0] != points[i, 0] or np.arccos(np.clip(directions[i] @ directions[j], -1, 1)) >= min_separation for j in chosen):
+            chosen.append(i)
+        if len(chosen) == n_candidates:
+            break
+    return np.array(chosen, dtype=int)
+
+def sweet_spot_search(system, radii, sigma_B, transitions=None, n_theta=8, n_phi=16, max_depth=4,
+                      top_fraction=0.1, variation=0.5, n_candidates=5, min_separation=0.1, polish=False, **t2_options):
+    """
+    Adaptive search for the field orientations with the longest T2
+
+    A coarse (theta, phi) grid is evaluated on every radius, then only the cells whose corner
+    T2 is in the top `top_fraction` of all evaluated points, or whose corner values differ by
+    more than `variation` (relative), are split into four, up to `max_depth` times. The best
+    separated points are returned as candidates and can be polished with a local optimizer
+    (Nelder-Mead on theta and phi, requires scipy).
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        radii: Field magnitude (T) or list of magnitudes for a shell
+        sigma_B: Standard deviation of the field noise (T)
+        transitions: (lower, upper) level pairs to consider (default: the three ms families)
+        n_theta, n_phi: Cells of the coarse grid in polar and azimuthal angle
+        max_depth: Maximum number of refinement levels
+        top_fraction: Fraction of the best T2 values whose cells are refined
+        variation: Relative T2 spread across a cell above which it is refined
+        n_candidates: Number of sweet-spot candidates returned
+        min_separation: Minimum angle (rad) between candidates on the same radius
+        polish: Refine the candidates with scipy.optimize.minimize
+        **t2_options: Passed on to t2_map (derivatives, degeneracy_tol, ...)
+
+    Returns:
+        dict: 'fields' (n, 3), 'spherical' (n, 3) as (r, theta, phi), 't2' (n,) and
+        'transition' (n,) of the candidates, best first, and the number of 'evaluations'
+    """
+    system = compile_system(system)
+    pairs = transition_pairs(system.dimension) if transitions is None else np.asarray(transitions, dtype=int).reshape(-1, 2)
+    evaluate = _t2_evaluator(system, sigma_B, pairs, **t2_options)
+
+    # Cells as rows of (r, theta0, theta1, phi0, phi1)
+    theta = np.linspace(0, np.pi, n_theta + 1)
+    phi = np.linspace(0, 2 * np.pi, n_phi + 1)
+    cells = np.array([(r, theta[i], theta[i + 1], phi[j], phi[j + 1])
+                      for r in np.atleast_1d(radii) for i in range(n_theta) for j in range(n_phi)], dtype=float)
+
+    def corners(cells):
+        r, t0, t1, p0, p1 = cells.T
+        return np.stack([np.stack([r, t, p], axis=-1) for t, p in ((t0, p0), (t0, p1), (t1, p0), (t1, p1))], axis=1)
+
+    for depth in range(max_depth + 1):
+        t2_corners = evaluate(corners(cells).reshape(-1, 3))[0].reshape(-1, 4)
+        if depth == max_depth:
+            break
+        all_t2 = np.array([v[0] for v in evaluate.values.values()])
+        threshold = np.quantile(all_t2, 1 - top_fraction)
+        best, worst = t2_corners.max(axis=1), t2_corners.min(axis=1)
+        refine = (best >= threshold) | ((best - worst) > variation * best)
+        if not refine.any():
+            break
+        r, t0, t1, p0, p1 = cells[refine].T
+        tm, pm = (t0 + t1) / 2, (p0 + p1) / 2
+        cells = np.concatenate([np.stack([r, a, b, c, d], axis=-1)
+                                for a, b in ((t0, tm), (tm, t1)) for c, d in ((p0, pm), (pm, p1))])
+
+    points = np.array([p for p in evaluate.values])
+    t2, index = (np.array(v) for v in zip(*evaluate.values.values()))
+    chosen = _select_candidates(points, t2, n_candidates, min_separation)
+    points, t2, index = points[chosen], t2[chosen], index[chosen].astype(int)
+
+    if polish:
+        from scipy.optimize import minimize
+        for n, (r, theta0, phi0) in enumerate(points):
+            objective = lambda x: -evaluate([(r, x[0], x[1])])[0][0]
+            result = minimize(objective, (theta0, phi0), method='Nelder-Mead',
+                              options={'xatol': 1e-4, 'fatol': 1e-6 * t2[n], 'maxiter': 200})
+            if -result.fun > t2[n]:
+                points[n] = (r, *result.x)
+                t2[n], index[n] = evaluate([points[n]])[:, 0]
+        order = np.argsort(-t2)
+        points, t2, index = points[order], t2[order], index[order].astype(int)
+
+    return {'fields': spherical_to_field(points[:, 0], points[:, 1], points[:, 2]), 'spherical': points,
+            't2': t2, 'transition': index, 'evaluations': evaluate.evaluations}
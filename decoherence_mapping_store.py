@@ -0,0 +1,156 @@
+#Checkpointed, resumable field sweeps with an on-disk result store
+import hashlib
+import json
+import os
+import numpy as np
+from decoherence_mapping_cache import system_fingerprint
+from decoherence_mapping_functions import compile_system, stencil_fields, stencil_step, stencil_level_derivatives, auto_chunk_size
+
+MANIFEST = 'manifest.json'
+STORE_VERSION = 2
+
+def sweep_fingerprint(system, B_arr, neighbour_arr):
+    """
+    Hash of the system parameters and the field grid, used to make sure a sweep is only
+    resumed with the system and grid it was started with
+    """
+    digest = hashlib.sha1(system_fingerprint(system).encode())
+    for array in (B_arr, neighbour_arr):
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def _write_manifest(directory, manifest):
+    """Atomically replace the manifest, so an interrupted write never corrupts it"""
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+def step_fingerprint(step):
+    """Hash of the resolved (N, 3) step sizes of the derived quantities"""
+    return hashlib.sha1(np.ascontiguousarray(step, dtype=float).tobytes()).hexdigest()
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+def sweep_to_disk(system, B_arr, neighbour_arr, directory, chunk_size=None, derived=None, delta_B=None, progress=None):
+    """
+    Stencil eigenvalue sweep written incrementally to memory-mapped .npy files
+
+    Every chunk is flushed to disk before it is recorded as complete in the manifest, so
+    calling the function again with the same system, grid and directory resumes after the
+    last completed chunk. A resume keeps the chunk size, `derived` and step sizes of the
+    store; passing different ones raises a ValueError rather than mixing them in one store.
+
+    Layout of `directory`:
+        manifest.json: shapes, chunk size, fingerprints of the sweep and of the step sizes,
+            and completed chunks
+        B_arr.npy, neighbour_arr.npy: the field grid
+        energies.npy: stencil eigenvalues (N, K + 1, d), as returned by energy_curvature
+        gradient.npy, hessian.npy: level derivatives (N, d, 3) and (N, d, 3, 3), if `derived`
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        B_arr: Central magnetic fields with shape (3, N)
+        neighbour_arr: Neighbour magnetic fields with shape (K, 3, N)
+        directory: Output directory, created if needed
+        chunk_size: Field points per checkpoint (default: sized from the Hilbert-space dimension,
+            or the chunk size of the store when resuming)
+        derived: Also store the level gradients and Hessians (default: True, or the setting of
+            the store when resuming)
+        delta_B: Field step sizes for the derived quantities (default: read from the grid)
+        progress: Optional callback progress(done, total), called after every checkpoint with
+            the number of completed field points, including those of earlier runs
+
+    Returns:
+        dict: Memory-mapped arrays of the completed store, see load_sweep
+    """
+    system = compile_system(system)
+    B_arr = np.asarray(B_arr, dtype=float)
+    neighbour_arr = np.asarray(neighbour_arr, dtype=float)
+    n_points, d = B_arr.shape[1], system.dimension
+    shape = (n_points, neighbour_arr.shape[0] + 1, d)
+    fingerprint = sweep_fingerprint(system, B_arr, neighbour_arr)
+    step = stencil_step(B_arr, neighbour_arr) if delta_B is None else np.broadcast_to(np.asarray(delta_B, dtype=float), (n_points, 3))
+    step_hash = step_fingerprint(step)
+    os.makedirs(directory, exist_ok=True)
+
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        manifest = read_manifest(directory)
+        if manifest['fingerprint'] != fingerprint:
+            raise ValueError(f"'{directory}' holds a sweep of a different system or field grid")
+        if 'step' not in manifest:
+            raise ValueError(f"'{directory}' was written without its step sizes (store version {manifest['version']}), start a new store")
+        if manifest['step'] != step_hash:
+            raise ValueError(f"'{directory}' holds a sweep with different step sizes (delta_B)")
+        for name, value in (('chunk_size', chunk_size), ('derived', derived)):
+            if value is not None and value != manifest[name]:
+                raise ValueError(f"'{directory}' holds a sweep with {name}={manifest[name]}, cannot resume with {name}={value}")
+        mode = 'r+'
+    else:
+        if chunk_size is None:
+            chunk_size = auto_chunk_size(shape[1], d)
+        manifest = {'version': STORE_VERSION, 'fingerprint': fingerprint, 'step': step_hash, 'shape': shape,
+                    'chunk_size': chunk_size, 'derived': True if derived is None else derived, 'completed': []}
+        np.save(os.path.join(directory, 'B_arr.npy'), B_arr)
+        np.save(os.path.join(directory, 'neighbour_arr.npy'), neighbour_arr)
+        mode = 'w+'
+
+    chunk_size, derived = manifest['chunk_size'], manifest['derived']
+    arrays = {'energies': shape}
+    if derived:
+        arrays.update(gradient=(n_points, d, 3), hessian=(n_points, d, 3, 3))
+    store = {name: np.lib.format.open_memmap(os.path.join(directory, name + '.npy'), mode=mode, dtype=float, shape=array_shape)
+             for name, array_shape in arrays.items()}
+    if mode == 'w+':
+        _write_manifest(directory, manifest)
+
+    completed = set(manifest['completed'])
+    for index, start in enumerate(range(0, n_points, chunk_size)):
+        if index in completed:
+            continue
+        stop = min(start + chunk_size, n_points)
+        fields = stencil_fields(B_arr[:, start:stop], neighbour_arr[:, :, start:stop])
+        energies = system.eigenvalues(fields) - system.ground_energy
+        store['energies'][start:stop] = energies
+        if derived:
+            store['gradient'][start:stop], store['hessian'][start:stop] = stencil_level_derivatives(energies, step[start:stop])
+        for array in store.values():
+            array.flush()
+
+        manifest['completed'].append(index)
+        _write_manifest(directory, manifest)
+        if progress is not None:
+            progress(sum(min(chunk_size, n_points - i * chunk_size) for i in manifest['completed']), n_points)
+
+    del store
+    return load_sweep(directory)
+
+def load_sweep(directory, mmap_mode='r', allow_partial=False):
+    """
+    Open a sweep store without loading it into memory
+
+    The returned arrays can be passed straight on, e.g.
+    curvature_transition_energy(system, s['B_arr'], s['neighbour_arr'], None, Energies=s['energies'])
+
+    Args:
+        directory: Store directory written by sweep_to_disk
+        mmap_mode: Memory-map mode passed to np.load
+        allow_partial: Open a store whose sweep has not finished yet
+
+    Returns:
+        dict: 'manifest' plus memory-mapped 'B_arr', 'neighbour_arr', 'energies' and, for
+        derived stores, 'gradient' and 'hessian'
+    """
+    manifest = read_manifest(directory)
+    n_chunks = -(-manifest['shape'][0] // manifest['chunk_size'])
+    if not allow_partial and len(manifest['completed']) < n_chunks:
+        raise ValueError(f"Sweep in '{directory}' is incomplete ({len(manifest['completed'])}/{n_chunks} chunks)")
+
+    names = ['B_arr', 'neighbour_arr', 'energies'] + (['gradient', 'hessian'] if manifest['derived'] else [])
+    store = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) for name in names}
+    store['manifest'] = manifest
+    return store
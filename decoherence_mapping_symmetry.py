@@ -0,0 +1,134 @@
+#Symmetry-reduced field grids
+import numpy as np
+from decoherence_mapping_functions import compile_system, t2_map
+
+def rotation_z(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+def candidate_operations(n_fold=12):
+    """
+    Orthogonal operations on the field vector tried by detect_field_symmetries: rotations
+    about z by multiples of 2*pi/n_fold, combined with the xz mirror plane and inversion
+    (4 * n_fold operations, covering the C3v/D3h/C6v/D6h families of VB- and NV-)
+    """
+    mirror = np.diag([1., -1., 1.])
+    return np.array([sign * rotation_z(2 * np.pi * k / n_fold) @ reflection
+                     for sign in (1, -1) for reflection in (np.eye(3), mirror) for k in range(n_fold)])
+
+def generate_group(generators, decimals=9):
+    """
+    Closure of a set of declared generators (3, 3) under composition, e.g.
+    generate_group([rotation_z(2*np.pi/3), -np.eye(3)]) for a declared C3 axis plus time reversal
+    """
+    group = {tuple(np.round(np.eye(3), decimals).ravel() + 0.0): np.eye(3)}
+    frontier = list(group.values())
+    while frontier:
+        new = []
+        for element in frontier:
+            for generator in generators:
+                product = np.asarray(generator, dtype=float) @ element
+                key = tuple(np.round(product, decimals).ravel() + 0.0)
+                if key not in group:
+                    group[key] = product
+                    new.append(product)
+        frontier = new
+    return np.array(list(group.values()))
+
+def detect_field_symmetries(system, candidates=None, magnitudes=(1e-3, 1e-2, 1e-1), n_directions=3, tol=1e-6, seed=0):
+    """
+    Operations R on the field vector that leave the spectrum unchanged, E(R B) = E(B)
+
+    Every candidate is checked on random field directions at each magnitude; it is kept if
+    all eigenvalues agree within `tol` (MHz). Inversion always passes, since time reversal
+    maps H(B) onto H(-B). Symmetries that the tabulated parameters only satisfy approximately
+    (e.g. the C3 axis of the rounded VB_14N1/2/3 tensors) are rejected at tight `tol`; they
+    can be declared instead with generate_group.
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        candidates: Operations (G, 3, 3) to test (default: candidate_operations())
+        magnitudes: Field magnitudes (T) of the test fields
+        n_directions: Random directions per magnitude
+        tol: Eigenvalue tolerance (MHz)
+        seed: Seed of the random test directions
+
+    Returns:
+        ndarray: Symmetry operations with shape (G', 3, 3), identity included
+    """
+    system = compile_system(system)
+    candidates = candidate_operations() if candidates is None else np.asarray(candidates, dtype=float)
+    directions = np.random.default_rng(seed).normal(size=(n_directions, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    fields = (np.asarray(magnitudes, dtype=float)[:, None, None] * directions).reshape(-1, 3)
+
+    reference = system.eigenvalues(fields)
+    transformed = system.eigenvalues(np.einsum('gij,nj->gni', candidates, fields))
+    return candidates[np.all(np.abs(transformed - reference) < tol, axis=(1, 2))]
+
+def irreducible_fields(fields, operations, decimals=9, chunk_size=2**16):
+    """
+    Map every field onto a canonical member of its symmetry orbit and keep the distinct ones
+
+    The representative of a field B is the lexicographically largest of the rounded R B over
+    all operations R, so fields related by symmetry share one representative.
+
+    Args:
+        fields: Magnetic fields with shape (N, 3)
+        operations: Symmetry operations with shape (G, 3, 3)
+        decimals: Rounding (T) used to identify equal fields
+
+    Returns:
+        Tuple: (representative fields (U, 3), inverse index (N,) into the representatives)
+    """
+    fields = np.asarray(fields, dtype=float)
+    canonical = np.empty_like(fields)
+    for start in range(0, len(fields), chunk_size):
+        orbit = np.round(np.einsum('gij,nj->gni', operations, fields[start:start + chunk_size]), decimals) + 0.0
+        last = np.lexsort((orbit[..., 2], orbit[..., 1], orbit[..., 0]), axis=0)[-1]
+        canonical[start:start + chunk_size] = orbit[last, np.arange(orbit.shape[1])]
+    representatives, inverse = np.unique(canonical, axis=0, return_inverse=True)
+    return representatives, inverse.ravel()
+
+def symmetric_evaluate(function, field_grid, operations, decimals=9):
+    """
+    Evaluate `function` only on the irreducible part of a field grid and expand the result
+
+    Only valid for quantities that are invariant under the operations, such as energies,
+    transition frequencies, gradient norms, mean curvatures and T2; vector quantities like
+    level gradients rotate with the field and cannot be copied this way.
+
+    Args:
+        function: Callable taking fields (3, U) and returning an array or a tuple of arrays
+            whose first axis runs over the fields
+        field_grid: Magnetic fields with shape (3, N)
+        operations: Symmetry operations with shape (G, 3, 3)
+
+    Returns:
+        Output of `function` for all N fields
+    """
+    representatives, inverse = irreducible_fields(np.asarray(field_grid, dtype=float).T, operations, decimals)
+    result = function(representatives.T)
+    if isinstance(result, tuple):
+        return tuple(np.asarray(r)[inverse] for r in result)
+    return np.asarray(result)[inverse]
+
+def symmetric_t2_map(system, field_grid, sigma_B, operations=None, decimals=9, **t2_options):
+    """
+    t2_map evaluated on the irreducible wedge of the grid only
+
+    Args:
+        system: (electron, nuclei) tuple or compiled_system
+        field_grid: Magnetic fields with shape (3, N)
+        sigma_B: Standard deviation of the field noise (T)
+        operations: Declared symmetry operations (G, 3, 3), see generate_group
+            (default: detect_field_symmetries(system))
+        **t2_options: Passed on to t2_map
+
+    Returns:
+        Tuple: (T2, transition index), as returned by t2_map
+    """
+    system = compile_system(system)
+    if operations is None:
+        operations = detect_field_symmetries(system)
+    return symmetric_evaluate(lambda B: t2_map(system, B, sigma_B, **t2_options), field_grid, operations, decimals)
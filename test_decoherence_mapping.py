@@ -0,0 +1,182 @@
+#Regression checks, run with python -m pytest
+import numpy as np
+import pytest
+from decoherence_mapping_parameters import electronic, nuclear
+from decoherence_mapping_profiling import profiler, stage
+from decoherence_mapping_functions import (compile_system, transition_pairs, transition_derivatives, stencil_offsets,
+                                           curvature_transition_energy, generalized_hamiltonian, batched_energy_curvature,
+                                           stencil_level_derivatives)
+from decoherence_mapping_store import sweep_to_disk, read_manifest
+from decoherence_mapping_cache import result_cache, cached_energy_curvature
+from decoherence_mapping_reduced import reduced_system, reduced_solver_error
+
+def rotation(axis, angle):
+    """Rotation matrix about a unit axis"""
+    axis = np.asarray(axis, dtype=float) / np.linalg.norm(axis)
+    K = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * K @ K
+
+def stencil_grid(B_arr, delta_B):
+    step = np.full((B_arr.shape[1], 3), delta_B)
+    return (B_arr.T[:, None, :] + stencil_offsets(step)).transpose(1, 2, 0)
+
+def test_curvature_of_sphere():
+    # f = |B|^2 has spheres of radius r as iso-frequency surfaces, mean curvature 1/r
+    B = np.array([[0.3, -0.4, 1.2], [2.0, 0.0, 0.0]])
+    energies = np.stack([np.zeros(2), np.sum(B**2, axis=1)], axis=1)
+    gradient = np.stack([np.zeros_like(B), 2 * B], axis=1)
+    hessian = np.stack([np.zeros((2, 3, 3)), np.broadcast_to(2 * np.eye(3), (2, 3, 3))], axis=1)
+    _, gradient_norm, curvature = transition_derivatives(energies, gradient, hessian, [(0, 1)])
+    np.testing.assert_allclose(gradient_norm[:, 0], 2 * np.linalg.norm(B, axis=1))
+    np.testing.assert_allclose(curvature[:, 0], 1 / np.linalg.norm(B, axis=1))
+
+def test_curvature_frame_invariance():
+    # Rotating the frame of the level derivatives must not change the curvature
+    rng = np.random.default_rng(1)
+    energies = rng.normal(size=(5, 6))
+    gradient = rng.normal(size=(5, 6, 3))
+    hessian = rng.normal(size=(5, 6, 3, 3))
+    hessian = hessian + hessian.swapaxes(-1, -2)
+    R = rotation([1, 2, 3], 0.7)
+    pairs = transition_pairs(6)
+    reference = transition_derivatives(energies, gradient, hessian, pairs)
+    rotated = transition_derivatives(energies, gradient @ R.T, R @ hessian @ R.T, pairs)
+    for a, b in zip(reference, rotated):
+        np.testing.assert_allclose(a, b, rtol=1e-10)
+
+def test_curvature_rotated_system():
+    # Rotating the field and the hyperfine and quadrupole frames together about the NV axis
+    # leaves the spectrum, and hence every curvature, unchanged
+    R = rotation([0, 0, 1], 0.9)
+    nucleus = nuclear('VB_14N1')
+    rotated = nucleus.replace(A=R @ nucleus.A @ R.T, Q=R @ nucleus.Q @ R.T)
+    B_arr = np.array([[4e-3, -2e-3, 7e-3], [1e-2, 5e-3, -3e-3]]).T
+    reference = curvature_transition_energy((electronic('NV-'), [nucleus]), B_arr, stencil_grid(B_arr, 1e-6), None,
+                                            derivatives='analytic', delta_B=1e-6)
+    result = curvature_transition_energy((electronic('NV-'), [rotated]), R @ B_arr, stencil_grid(R @ B_arr, 1e-6), None,
+                                         derivatives='analytic', delta_B=1e-6)
+    for a, b in zip(reference, result):
+        np.testing.assert_allclose(a, b, rtol=1e-4)
+
+def test_stencil_matches_analytic():
+    # At a small step the finite-difference curvature converges to the perturbative one
+    system = compile_system((electronic('NV-'), [nuclear('NV_15N')]))
+    B_arr = np.array([[4e-3, -2e-3, 7e-3], [1e-2, 5e-3, -3e-3], [-2e-2, 1e-2, 2e-2]]).T
+    neighbour_arr = stencil_grid(B_arr, 1e-5)
+    stencil = curvature_transition_energy(system, B_arr, neighbour_arr, generalized_hamiltonian, derivatives='stencil')
+    analytic = curvature_transition_energy(system, B_arr, neighbour_arr, generalized_hamiltonian, derivatives='analytic')
+    for a, b in zip(stencil, analytic):
+        np.testing.assert_allclose(a, b, rtol=1e-3)
+
+def test_profiler_nested_peak_memory():
+    # A peak reached two levels down must show up in every enclosing stage
+    with profiler() as prof:
+        with stage('outer'):
+            with stage('mid'):
+                with stage('inner'):
+                    block = np.ones(10**7)
+                    del block
+    report = prof.report()
+    for name in ('outer', 'mid', 'inner'):
+        assert report[name]['peak_bytes'] >= 8 * 10**7
+        assert report[name]['calls'] == 1
+
+class _interrupted:
+    """Eigenvalues interface of a compiled system that fails after `limit` calls"""
+    def __init__(self, system, limit):
+        self.system, self.limit, self.calls = system, limit, 0
+        self.electron, self.nuclei, self.dimension = system.electron, system.nuclei, system.dimension
+        self.ground_energy = system.ground_energy
+
+    def eigenvalues(self, fields):
+        self.calls += 1
+        if self.calls > self.limit:
+            raise KeyboardInterrupt
+        return self.system.eigenvalues(fields)
+
+def test_sweep_resume(tmp_path):
+    system = compile_system((electronic('NV-'), [nuclear('NV_15N')]))
+    B_arr = np.random.default_rng(2).normal(size=(3, 10)) * 1e-2
+    neighbour_arr = stencil_grid(B_arr, 1e-4)
+    directory = str(tmp_path / 'sweep')
+
+    with pytest.raises(KeyboardInterrupt):
+        sweep_to_disk(_interrupted(system, 2), B_arr, neighbour_arr, directory, chunk_size=3, delta_B=1e-4)
+    assert read_manifest(directory)['completed'] == [0, 1]
+
+    # A resume with different settings must not mix them into the store
+    for options in ({'delta_B': 5e-4}, {'derived': False}, {'chunk_size': 4}):
+        with pytest.raises(ValueError):
+            sweep_to_disk(system, B_arr, neighbour_arr, directory, **{'delta_B': 1e-4, **options})
+
+    # Only the two missing chunks are computed on resume
+    resumed = _interrupted(system, 2)
+    store = sweep_to_disk(resumed, B_arr, neighbour_arr, directory, delta_B=1e-4)
+    assert resumed.calls == 2
+    energies = batched_energy_curvature(system, B_arr, neighbour_arr)
+    gradient, hessian = stencil_level_derivatives(energies, np.full((10, 3), 1e-4))
+    np.testing.assert_allclose(store['energies'], energies, atol=1e-9)
+    np.testing.assert_allclose(store['gradient'], gradient, rtol=1e-9, atol=1e-3)
+    np.testing.assert_allclose(store['hessian'], hessian, rtol=1e-9, atol=1e1)
+
+class _counting:
+    """Eigenvalues interface of a compiled system that counts the diagonalized fields"""
+    def __init__(self, system):
+        self.system, self.fields = system, 0
+        self.electron, self.nuclei, self.dimension = system.electron, system.nuclei, system.dimension
+        self.ground_energy = system.ground_energy
+
+    def eigenvalues(self, fields):
+        self.fields += len(fields)
+        return self.system.eigenvalues(fields)
+
+def test_cache_round_trip_and_reuse(tmp_path):
+    system = compile_system((electronic('NV-'), [nuclear('NV_15N')]))
+    B_arr = np.random.default_rng(3).normal(size=(3, 8)) * 1e-2
+    cache = result_cache(str(tmp_path / 'cache.db'))
+    counting = _counting(system)
+
+    first = cached_energy_curvature(counting, B_arr, stencil_grid(B_arr, 1e-4), cache)
+    np.testing.assert_array_equal(first, batched_energy_curvature(system, B_arr, stencil_grid(B_arr, 1e-4)))
+    assert counting.fields == 8 * 19
+
+    # A second run is served from the cache with the same values
+    again = cached_energy_curvature(counting, B_arr, stencil_grid(B_arr, 1e-4), cache)
+    np.testing.assert_array_equal(again, first)
+    assert counting.fields == 8 * 19
+
+    # A finer step reuses the centres and only computes the new neighbours
+    finer = cached_energy_curvature(counting, B_arr, stencil_grid(B_arr, 1e-5), cache)
+    assert counting.fields == 8 * 19 + 8 * 18
+    np.testing.assert_allclose(finer, batched_energy_curvature(system, B_arr, stencil_grid(B_arr, 1e-5)), atol=1e-9)
+    cache.close()
+
+def test_cache_eviction(tmp_path):
+    d = 6
+    cache = result_cache(str(tmp_path / 'cache.db'), max_bytes=10 * d * 8)
+    cache.put([(f'old{i}', np.full(d, i, dtype=float)) for i in range(10)])
+    cache.get(['old0'])  # used again, so it is kept
+    cache.put([(f'new{i}', np.full(d, i, dtype=float)) for i in range(5)])
+    assert cache.size() <= cache.max_bytes
+    found = cache.get([f'old{i}' for i in range(10)] + [f'new{i}' for i in range(5)])
+    assert 'old0' in found and all(f'new{i}' in found for i in range(5))
+    assert len(found) == 10
+    np.testing.assert_array_equal(np.frombuffer(found['new3']), np.full(d, 3.0))
+    cache.close()
+
+@pytest.mark.parametrize('nuclei', [['NV_15N'], ['NV_14N', 'NV_13C']])
+def test_reduced_solver_error_bound(nuclei):
+    # Zero field (degenerate ms=+-1 block), a generic field and close to the ground-state level
+    # crossing at Bz = D/g, where ms=0 and ms=-1 share a block
+    system = reduced_system(electronic('NV-'), [nuclear(name) for name in nuclei])
+    crossing = system.electron.D / abs(system.electron.g)
+    fields = np.array([[0, 0, 0], [3e-3, -2e-3, 5e-3], [1e-4, 0, crossing - 5e-4], [0, 0, crossing]])
+    estimate = system.error_estimate(fields)
+    assert np.all(estimate > 0)
+    assert np.all(reduced_solver_error(system, fields) <= estimate)
+
+def test_replace_spin_updates_dimension():
+    nucleus = nuclear('NV_15N').replace(spin=1)
+    assert nucleus.dimension == 3
+    assert nuclear('NV_15N').replace(spin=1, dimension=2).dimension == 2
+    assert compile_system((electronic('NV-'), [nucleus])).dimension == 9